@@ -0,0 +1,49 @@
+import argparse
+import json
+import os
+from huggingface_hub import snapshot_download
+
+# Files needed to load a model and its tokenizer with transformers.
+ALLOW_PATTERNS = [
+    '*.json',
+    '*.txt',
+    '*.model',
+    '*.safetensors',
+    'pytorch_model.bin'
+]
+
+def main(args):
+    '''Download a GECToR model and its base transformer into a local artifact directory.
+
+    Start the API with GECTOR_ARTIFACT_DIR=<out> to load them without network access.
+    '''
+    os.makedirs(args.out, exist_ok=True)
+    model_dir = snapshot_download(
+        args.model_id,
+        revision=args.revision,
+        cache_dir=args.out,
+        allow_patterns=ALLOW_PATTERNS
+    )
+    # The directory of the snapshot is named after its commit hash.
+    print(f'Downloaded {args.model_id}@{args.revision} (commit {os.path.basename(model_dir)}) to {model_dir}')
+    # GECToR builds its encoder from the base model, e.g. roberta-base, so it is needed as well.
+    with open(os.path.join(model_dir, 'config.json')) as f:
+        base_model_id = json.load(f)['model_id']
+    base_dir = snapshot_download(
+        base_model_id,
+        cache_dir=args.out,
+        allow_patterns=ALLOW_PATTERNS
+    )
+    print(f'Downloaded {base_model_id} to {base_dir}')
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--model_id', default='gotutiyan/gector-roberta-base-5k')
+    parser.add_argument('--revision', default='main')
+    parser.add_argument('--out', default='artifacts')
+    args = parser.parse_args()
+    return args
+
+if __name__ == '__main__':
+    args = get_parser()
+    main(args)
@@ -1,8 +1,13 @@
 from .modeling import GECToR
 from .configuration import GECToRConfig
 from .dataset import load_dataset, GECToRDataset
-from .predict import predict, load_verb_dict
+from .predict import predict, load_verb_dict, IterativeScheduler
 from .predict_verbose import predict_verbose
+from .export import ExportedGECToR, export_onnx, export_torchscript
+from .precision import set_precision
+from .sweep import sweep_thresholds
+from .batcher import MicroBatcher, ContinuousBatcher, QueueFullError
+from .segmentation import split_sentences, tokenize_words, detokenize
 from .vocab import (
     build_vocab,
     load_vocab_from_config,
@@ -15,7 +20,19 @@ __all__ = [
     'GECToRDataset',
     'predict',
     'load_verb_dict',
+    'IterativeScheduler',
     'predict_verbose',
+    'ExportedGECToR',
+    'export_onnx',
+    'export_torchscript',
+    'set_precision',
+    'sweep_thresholds',
+    'MicroBatcher',
+    'ContinuousBatcher',
+    'QueueFullError',
+    'split_sentences',
+    'tokenize_words',
+    'detokenize',
     'build_vocab',
     'load_vocab_from_config',
     'load_vocab_from_official'
@@ -0,0 +1,344 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, List, Optional
+from .metrics import REGISTRY, stage_timer
+
+class QueueFullError(Exception):
+    '''Raised by MicroBatcher.submit() and ContinuousBatcher.submit() when max_pending jobs are already waiting.'''
+
+@dataclass
+class _Job:
+    srcs: List[str]
+    future: Future
+    on_result: Optional[Callable[[int, Any], None]] = None
+    n_tokens: int = None
+    submitted_at: float = field(default_factory=time.perf_counter)
+
+class MicroBatcher:
+    '''Aggregate concurrent prediction requests into one predict() call.
+
+    The first job that arrives opens a batch. The batch is closed when
+    max_wait_ms has passed, or when max_batch_size sentences or
+    max_batch_tokens subwords have been collected, whichever comes first.
+    A job is never split across batches, so a job that is larger than the
+    budget is run on its own.
+
+    Batches are run by n_workers inference threads. While all of them are busy,
+    new jobs wait in a queue of at most max_pending jobs (and are batched
+    together once a worker becomes free); submit() raises QueueFullError
+    when the queue is full so that callers can shed load early.
+
+    Args:
+        predict_fn: Takes a list of sources and a callback, and returns a list of
+            results in the same order. If the callback is not None, predict_fn
+            should call callback(index, result) as soon as each result is ready.
+            E.g. lambda srcs, callback: predict(model, tokenizer, srcs, encode, decode, callback=callback)
+        max_wait_ms (float): How long the first job of a batch waits for other jobs.
+        max_batch_size (int): The maximum number of sentences in one predict_fn() call.
+        max_batch_tokens (int): The maximum number of subwords in one predict_fn() call.
+        length_fn: Returns the number of subwords of a source.
+            If None, the number of whitespace-separated words is used.
+            It is called only from the batching thread, so it may use the same
+            (not thread-safe) tokenizer as predict_fn.
+        n_workers (int): The number of batches that can run predict_fn() concurrently.
+            If it is larger than 1, predict_fn must be thread-safe.
+        max_pending (int): The maximum number of jobs waiting for a worker. 0 means unlimited.
+    '''
+    def __init__(
+        self,
+        predict_fn: Callable[[List[str], Optional[Callable[[int, Any], None]]], List[Any]],
+        max_wait_ms: float=5,
+        max_batch_size: int=32,
+        max_batch_tokens: int=4096,
+        length_fn: Optional[Callable[[str], int]]=None,
+        n_workers: int=1,
+        max_pending: int=0
+    ):
+        self.predict_fn = predict_fn
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.length_fn = length_fn or (lambda src: len(src.split()))
+        self.n_workers = n_workers
+        self.max_pending = max_pending
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._closed = False
+        self._slots = threading.Semaphore(n_workers)
+        self._executor = ThreadPoolExecutor(
+            max_workers=n_workers,
+            thread_name_prefix='gector-inference'
+        )
+        self._thread = threading.Thread(
+            target=self._run,
+            name='gector-batcher',
+            daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def pending(self) -> int:
+        '''The number of jobs waiting for a worker.'''
+        return self._queue.qsize()
+
+    def submit(
+        self,
+        srcs: List[str],
+        on_result: Optional[Callable[[int, Any], None]]=None
+    ) -> Future:
+        '''Enqueue sources and return a Future of their results.
+
+        If on_result is given, on_result(index, result) is called from the inference
+            thread as soon as the result of srcs[index] is ready, before the Future is resolved.
+
+        Raises:
+            QueueFullError: If max_pending jobs are already waiting.
+        '''
+        if self._closed:
+            raise RuntimeError('MicroBatcher is closed.')
+        future = Future()
+        try:
+            self._queue.put_nowait(_Job(srcs, future, on_result))
+        except queue.Full:
+            raise QueueFullError(
+                f'{self.max_pending} jobs are already waiting.'
+            ) from None
+        return future
+
+    def close(self) -> None:
+        '''Stop accepting jobs and wait until the queued jobs are processed.'''
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+        self._executor.shutdown(wait=True)
+
+    def _count_tokens(self, job: _Job) -> int:
+        if job.n_tokens is None:
+            job.n_tokens = sum(self.length_fn(src) for src in job.srcs)
+        return job.n_tokens
+
+    def _collect(self, first: _Job):
+        '''Collect jobs following the first one within the budget.
+
+        Returns the collected jobs, a job that did not fit into the batch (or None),
+            and whether the stop signal was received.
+        '''
+        jobs = [first]
+        n_srcs = len(first.srcs)
+        n_tokens = self._count_tokens(first)
+        deadline = time.monotonic() + self.max_wait
+        while n_srcs < self.max_batch_size and n_tokens < self.max_batch_tokens:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                job = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if job is None:
+                return jobs, None, True
+            if n_srcs + len(job.srcs) > self.max_batch_size \
+                    or n_tokens + self._count_tokens(job) > self.max_batch_tokens:
+                return jobs, job, False
+            jobs.append(job)
+            n_srcs += len(job.srcs)
+            n_tokens += job.n_tokens
+        return jobs, None, False
+
+    def _run(self) -> None:
+        carry = None
+        while True:
+            # Wait for a free worker first, so that jobs keep accumulating
+            #   in the queue (and form a larger batch) while all workers are busy.
+            self._slots.acquire()
+            job = carry if carry is not None else self._queue.get()
+            if job is None:
+                return
+            jobs, carry, stop = self._collect(job)
+            self._executor.submit(self._process, jobs)
+            if stop:
+                return
+
+    def _process(self, jobs: List[_Job]) -> None:
+        try:
+            self._predict_jobs(jobs)
+        finally:
+            self._slots.release()
+
+    def _predict_jobs(self, jobs: List[_Job]) -> None:
+        # Skip the jobs which were cancelled while waiting.
+        jobs = [job for job in jobs if job.future.set_running_or_notify_cancel()]
+        if jobs == []:
+            return
+        now = time.perf_counter()
+        for job in jobs:
+            stage_timer('queue_wait').observe(now - job.submitted_at)
+        REGISTRY.histogram(
+            'gector_batcher_jobs', 'Number of jobs merged into one predict_fn() call',
+            buckets=(1, 2, 4, 8, 16, 32, 64)
+        ).observe(len(jobs))
+        srcs = [src for job in jobs for src in job.srcs]
+        callback = None
+        if any(job.on_result is not None for job in jobs):
+            # Map an index of the merged batch back to (job, index in the job).
+            owners = [(job, i) for job in jobs for i in range(len(job.srcs))]
+            def forward_result(index: int, result: Any) -> None:
+                job, i = owners[index]
+                if job.on_result is not None:
+                    job.on_result(i, result)
+            callback = forward_result
+        try:
+            results = self.predict_fn(srcs, callback)
+        except Exception as e:
+            for job in jobs:
+                job.future.set_exception(e)
+            return
+        offset = 0
+        for job in jobs:
+            job.future.set_result(results[offset:offset+len(job.srcs)])
+            offset += len(job.srcs)
+
+@dataclass
+class _ScheduledJob:
+    job: _Job
+    results: List[Any]
+    remaining: int
+
+class ContinuousBatcher:
+    '''Feed concurrent prediction requests into a running IterativeScheduler.
+
+    Unlike MicroBatcher, sentences are not grouped per predict() call: every
+    worker keeps a working set of up to max_batch_size sentences and runs one
+    correction iteration over it at a time. Sentences that are finished leave
+    the working set right away and queued jobs take their place before the
+    next iteration, so a short request does not wait for the iterations of
+    the long ones that arrived with it, and the forward batches stay full.
+
+    A job is admitted as a whole. While the working set is full, new jobs wait
+    in a queue of at most max_pending jobs; submit() raises QueueFullError
+    when the queue is full.
+
+    Args:
+        scheduler_fn: Returns a new IterativeScheduler. It is called from the worker
+            thread that uses the scheduler, when the first job arrives, so it may
+            use a per-thread tokenizer.
+        max_batch_size (int): The number of sentences in the working set of a worker.
+        n_workers (int): The number of worker threads, each with its own scheduler.
+        max_pending (int): The maximum number of jobs waiting for a worker. 0 means unlimited.
+    '''
+    def __init__(
+        self,
+        scheduler_fn: Callable[[], Any],
+        max_batch_size: int=32,
+        n_workers: int=1,
+        max_pending: int=0
+    ):
+        self.scheduler_fn = scheduler_fn
+        self.max_batch_size = max_batch_size
+        self.n_workers = n_workers
+        self.max_pending = max_pending
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._run, name=f'gector-inference-{i}', daemon=True)
+            for i in range(n_workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    @property
+    def pending(self) -> int:
+        '''The number of jobs waiting for a worker.'''
+        return self._queue.qsize()
+
+    def submit(
+        self,
+        srcs: List[str],
+        on_result: Optional[Callable[[int, Any], None]]=None
+    ) -> Future:
+        '''Enqueue sources and return a Future of their results.
+
+        If on_result is given, on_result(index, result) is called from the inference
+            thread as soon as the result of srcs[index] is ready, before the Future is resolved.
+
+        Raises:
+            QueueFullError: If max_pending jobs are already waiting.
+        '''
+        if self._closed:
+            raise RuntimeError('ContinuousBatcher is closed.')
+        future = Future()
+        try:
+            self._queue.put_nowait(_Job(srcs, future, on_result))
+        except queue.Full:
+            raise QueueFullError(
+                f'{self.max_pending} jobs are already waiting.'
+            ) from None
+        return future
+
+    def close(self) -> None:
+        '''Stop accepting jobs and wait until the queued jobs are processed.'''
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _admit(self, scheduler, job: _Job, active: List[_ScheduledJob]) -> None:
+        stage_timer('queue_wait').observe(time.perf_counter() - job.submitted_at)
+        if job.srcs == []:
+            job.future.set_result([])
+            return
+        scheduled = _ScheduledJob(job, [None] * len(job.srcs), len(job.srcs))
+        active.append(scheduled)
+        def callback(index: int, result: Any) -> None:
+            scheduled.results[index] = result
+            scheduled.remaining -= 1
+            if job.on_result is not None:
+                job.on_result(index, result)
+            if scheduled.remaining == 0:
+                active.remove(scheduled)
+                job.future.set_result(scheduled.results)
+        for i, src in enumerate(job.srcs):
+            scheduler.add(src, lambda result, i=i: callback(i, result))
+
+    def _run(self) -> None:
+        scheduler = None
+        active = []
+        stopping = False
+        while True:
+            # Top up the working set before every iteration; block only when there is nothing to run.
+            while not stopping and (scheduler is None or len(scheduler) < self.max_batch_size):
+                try:
+                    job = self._queue.get(block=active == [])
+                except queue.Empty:
+                    break
+                if job is None:
+                    stopping = True
+                    break
+                # Skip the jobs which were cancelled while waiting.
+                if not job.future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    if scheduler is None:
+                        scheduler = self.scheduler_fn()
+                    self._admit(scheduler, job, active)
+                except Exception as e:
+                    job.future.set_exception(e)
+            if active == []:
+                if stopping:
+                    return
+                continue
+            try:
+                scheduler.step()
+            except Exception as e:
+                # The state of the scheduler is unknown, so all its sentences fail.
+                for scheduled in active:
+                    scheduled.job.future.set_exception(e)
+                active = []
+                scheduler = None
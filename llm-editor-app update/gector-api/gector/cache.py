@@ -0,0 +1,248 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+# Bumped when the format of the cached values changes, so that old entries
+#   in a shared SQLite database are not read.
+CACHE_FORMAT_VERSION = 3
+
+def normalize_sentence(sentence: str) -> str:
+    '''Collapse runs of whitespace so that trivially different inputs share a cache entry.'''
+    return ' '.join(sentence.split())
+
+class CorrectionCache:
+    '''LRU cache of corrected sentences with expiration.
+
+    Entries are kept in memory up to max_entries and evicted in LRU order.
+    If db_path is given, entries are also written to a SQLite database,
+    so that several processes (e.g. uvicorn workers) on the same machine
+    share their results. A memory miss falls back to the database.
+
+    Args:
+        max_entries (int): The maximum number of entries kept in memory.
+        ttl (float): Seconds until an entry expires. 0 means never.
+        db_path (str): Path to the SQLite database. If None, only memory is used.
+        max_db_entries (int): The maximum number of entries kept in the database.
+    '''
+    def __init__(
+        self,
+        max_entries: int=10000,
+        ttl: float=3600,
+        db_path: Optional[str]=None,
+        max_db_entries: int=1000000
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self.max_db_entries = max_db_entries
+        self._entries = OrderedDict()  # key -> (value, expire time)
+        self._lock = threading.Lock()
+        self._n_puts = 0
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self._db = None
+        if db_path is not None:
+            self._db = sqlite3.connect(db_path, timeout=5, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS corrections '
+                '(key TEXT PRIMARY KEY, value TEXT, expire REAL)'
+            )
+            self._db.commit()
+
+    @staticmethod
+    def make_key(
+        sentence: str,
+        model_id: str,
+        keep_confidence: float,
+        min_error_prob: float,
+        n_iteration: int,
+        top_k: int=0
+    ) -> str:
+        payload = json.dumps([
+            CACHE_FORMAT_VERSION,
+            normalize_sentence(sentence),
+            model_id,
+            float(keep_confidence),
+            float(min_error_prob),
+            int(n_iteration),
+            int(top_k)
+        ])
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def _expire_time(self) -> float:
+        return time.time() + self.ttl if self.ttl > 0 else float('inf')
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                del self._entries[key]
+            if self._db is not None:
+                row = self._db.execute(
+                    'SELECT value, expire FROM corrections WHERE key = ?',
+                    (key,)
+                ).fetchone()
+                if row is not None and row[1] > now:
+                    self._set(key, row[0], row[1])
+                    self.db_hits += 1
+                    return row[0]
+            self.misses += 1
+            return None
+
+    def get_many(self, keys: List[str]) -> List[Optional[str]]:
+        return [self.get(key) for key in keys]
+
+    def put(self, key: str, value: str) -> None:
+        expire = self._expire_time()
+        with self._lock:
+            self._set(key, value, expire)
+            if self._db is not None:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO corrections VALUES (?, ?, ?)',
+                    (key, value, expire)
+                )
+                self._db.commit()
+                self._n_puts += 1
+                if self._n_puts % 1000 == 0:
+                    self._prune_db()
+
+    def count_coalesced(self) -> None:
+        '''Count a lookup that waited for an identical sentence being corrected instead.'''
+        with self._lock:
+            self.coalesced += 1
+
+    def put_many(self, items: Dict[str, str]) -> None:
+        for key, value in items.items():
+            self.put(key, value)
+
+    def _set(self, key: str, value: str, expire: float) -> None:
+        self._entries[key] = (value, expire)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _prune_db(self) -> None:
+        self._db.execute('DELETE FROM corrections WHERE expire <= ?', (time.time(),))
+        self._db.execute(
+            'DELETE FROM corrections WHERE key NOT IN '
+            '(SELECT key FROM corrections ORDER BY expire DESC LIMIT ?)',
+            (self.max_db_entries,)
+        )
+        self._db.commit()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            n_lookups = self.hits + self.db_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'db_hits': self.db_hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'hit_rate': (self.hits + self.db_hits) / n_lookups if n_lookups else 0.0
+            }
+
+class VersionStore:
+    '''Bounded LRU map from a version token to the per-sentence results of a document.
+
+    A client sends back the token of the version it last received, so that
+    the results of sentences that did not change can be reused.
+    Versions are evicted in LRU order when there are more than max_versions of them
+    or their JSON takes more than max_bytes in total; a larger version is not kept.
+    If db_path is given, versions are also written to a SQLite database, so that
+    a document may be sent to any of the workers sharing it.
+
+    Args:
+        max_versions (int): The maximum number of versions kept.
+        max_bytes (int): The maximum total size of the kept versions, in bytes of JSON.
+        db_path (str): Path to the SQLite database. If None, only memory is used.
+    '''
+    def __init__(
+        self,
+        max_versions: int=1000,
+        max_bytes: int=64 * 1024 * 1024,
+        db_path: Optional[str]=None
+    ):
+        self.max_versions = max_versions
+        self.max_bytes = max_bytes
+        self.db_path = db_path
+        self._versions = OrderedDict()  # token -> value as JSON
+        self._n_bytes = 0
+        self._lock = threading.Lock()
+        self._db = None
+        if db_path is not None:
+            self._db = sqlite3.connect(db_path, timeout=5, check_same_thread=False)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS versions '
+                '(token TEXT PRIMARY KEY, value TEXT, size INTEGER, used REAL)'
+            )
+            self._db.commit()
+
+    def get(self, token: str) -> Optional[Dict]:
+        with self._lock:
+            value = self._versions.get(token)
+            if value is not None:
+                self._versions.move_to_end(token)
+            elif self._db is not None:
+                row = self._db.execute('SELECT value FROM versions WHERE token = ?', (token,)).fetchone()
+                if row is not None:
+                    value = row[0]
+                    self._db.execute('UPDATE versions SET used = ? WHERE token = ?', (time.time(), token))
+                    self._db.commit()
+                    self._set(token, value)
+            return json.loads(value) if value is not None else None
+
+    def put(self, value: Dict) -> str:
+        '''Store a new version and return its token.'''
+        token = uuid.uuid4().hex
+        value = json.dumps(value)
+        if len(value) > self.max_bytes:
+            return token
+        with self._lock:
+            self._set(token, value)
+            if self._db is not None:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO versions VALUES (?, ?, ?, ?)',
+                    (token, value, len(value), time.time())
+                )
+                self._prune_db()
+                self._db.commit()
+        return token
+
+    def _set(self, token: str, value: str) -> None:
+        self._versions[token] = value
+        self._n_bytes += len(value)
+        while len(self._versions) > self.max_versions or self._n_bytes > self.max_bytes:
+            _, evicted = self._versions.popitem(last=False)
+            self._n_bytes -= len(evicted)
+
+    def _prune_db(self) -> None:
+        n_versions = n_bytes = 0
+        stale = []
+        for token, size in self._db.execute('SELECT token, size FROM versions ORDER BY used DESC'):
+            n_versions += 1
+            n_bytes += size
+            if n_versions > self.max_versions or n_bytes > self.max_bytes:
+                stale.append((token,))
+        self._db.executemany('DELETE FROM versions WHERE token = ?', stale)
+
+    def __len__(self) -> int:
+        return len(self._versions)
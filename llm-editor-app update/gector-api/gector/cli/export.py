@@ -0,0 +1,56 @@
+import argparse
+import json
+import sys
+from gector import GECToR
+from gector.export import (
+    export_onnx,
+    export_torchscript,
+    ExportedGECToR,
+    check_parity
+)
+from transformers import AutoTokenizer
+
+def main(args):
+    model = GECToR.from_pretrained(args.restore_dir).eval()
+    tokenizer = AutoTokenizer.from_pretrained(args.restore_dir)
+    if args.format == 'onnx':
+        path = export_onnx(model, args.out, tokenizer, opset_version=args.opset)
+    else:
+        path = export_torchscript(model, args.out, tokenizer)
+    print(f'Exported to {path}')
+    if args.check_file is None:
+        return
+    # Parity test on a fixed corpus, one sentence per line.
+    srcs = open(args.check_file).read().rstrip().split('\n')
+    exported = ExportedGECToR(args.out, args.format)
+    result = check_parity(model, exported, tokenizer, srcs, args.batch_size)
+    print(json.dumps(result, indent=2))
+    if result['max_abs_diff_labels'] > args.atol or result['max_abs_diff_d'] > args.atol:
+        print(f'The probabilities differ by more than {args.atol}.')
+        sys.exit(1)
+
+def cli_main():
+    args = get_parser()
+    main(args)
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--restore_dir', required=True)
+    parser.add_argument('--out', required=True, help='The output directory.')
+    parser.add_argument('--format', choices=['onnx', 'torchscript'], default='onnx')
+    parser.add_argument('--opset', type=int, default=14)
+    parser.add_argument(
+        '--check_file',
+        help='If given, compare the exported graph with the PyTorch model on these sentences.'
+    )
+    parser.add_argument('--batch_size', type=int, default=32)
+    parser.add_argument(
+        '--atol', type=float, default=1e-4,
+        help='The maximum absolute difference of the probabilities allowed by the check.'
+    )
+    args = parser.parse_args()
+    return args
+
+if __name__ == '__main__':
+    args = get_parser()
+    main(args)
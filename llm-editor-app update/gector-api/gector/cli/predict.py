@@ -1,11 +1,18 @@
 import argparse
 from gector import (
     GECToR,
+    ExportedGECToR,
     predict,
     load_verb_dict,
     predict_verbose
 )
+from gector.precision import set_precision, compare_precision
+from gector.replicas import ReplicaPool
+from gector.metrics import REGISTRY
+from gector.streaming import stream_predict
 from transformers import AutoTokenizer
+import functools
+import json
 import torch
 from typing import List, Dict
 
@@ -36,10 +43,8 @@ def visualizer(iteration_log: List[List[Dict]]):
         strs += '\n'
     return strs
                 
-def main(args):
-    if args.test:
-        test()
-        return
+def load_model(args):
+    # The model and the tokenizer before set_precision().
     if args.from_official:
         # Use official weights.
         model = GECToR.from_official_pretrained(
@@ -59,13 +64,73 @@ def main(args):
             tokenizer.add_special_tokens(
                 {'additional_special_tokens': ['$START']}
             )
+    elif args.backend != 'torch':
+        # A directory exported by gector-export, run on CPU.
+        model = ExportedGECToR(args.restore_dir, args.backend)
+        tokenizer = AutoTokenizer.from_pretrained(args.restore_dir)
     else:
         model = GECToR.from_pretrained(args.restore_dir).eval()
         tokenizer = AutoTokenizer.from_pretrained(args.restore_dir)
-    srcs = open(args.input).read().rstrip().split('\n')
-    encode, decode = load_verb_dict(args.verb_file)
-    if torch.cuda.is_available():
+    return model, tokenizer
+
+def prepare_model(model, args):
+    if args.precision != 'fp32':
+        # The reduced precisions are for CPU inference.
+        return set_precision(model, args.precision)
+    if torch.cuda.is_available() and isinstance(model, GECToR):
         model.cuda()
+    return model
+
+def load_model_for_inference(args):
+    # Called in each worker of --stream.
+    model, tokenizer = load_model(args)
+    return prepare_model(model, args), tokenizer
+
+def main(args):
+    if args.test:
+        test()
+        return
+    encode, decode = load_verb_dict(args.verb_file)
+    if args.stream:
+        # Chunked, ordered and resumable, see gector.streaming.
+        n_lines = stream_predict(
+            args.input,
+            args.out,
+            functools.partial(load_model_for_inference, args),
+            {
+                'encode': encode,
+                'decode': decode,
+                'keep_confidence': args.keep_confidence,
+                'min_error_prob': args.min_error_prob,
+                'batch_size': args.batch_size,
+                'n_iteration': args.n_iteration,
+                'max_batch_tokens': args.max_batch_tokens,
+                'pipeline_depth': args.pipeline_depth
+            },
+            chunk_size=args.chunk_size,
+            n_workers=args.n_workers,
+            checkpoint_path=args.checkpoint
+        )
+        print(f'Corrected {n_lines} lines.')
+        return
+    model, tokenizer = load_model(args)
+    srcs = open(args.input).read().rstrip().split('\n')
+    if args.precision_check:
+        # Correct the input with fp32 and the precision and report the differences.
+        report = compare_precision(
+            model, tokenizer, srcs, encode, decode, args.precision,
+            keep_confidence=args.keep_confidence,
+            min_error_prob=args.min_error_prob,
+            batch_size=args.batch_size,
+            n_iteration=args.n_iteration,
+            max_batch_tokens=args.max_batch_tokens
+        )
+        print(json.dumps(report, indent=2))
+        return
+    model = prepare_model(model, args)
+    if args.n_replicas > 1:
+        # Data-parallel on CPU, see gector.replicas.
+        model = ReplicaPool(model, args.n_replicas)
     predict_args = {
         'model': model,
         'tokenizer': tokenizer,
@@ -75,7 +140,8 @@ def main(args):
         'keep_confidence': args.keep_confidence,
         'min_error_prob': args.min_error_prob,
         'batch_size': args.batch_size,
-        'n_iteration': args.n_iteration
+        'n_iteration': args.n_iteration,
+        'max_batch_tokens': args.max_batch_tokens
     }
     if args.visualize is not None:
         final_corrected_sents, iteration_log = predict_verbose(
@@ -86,10 +152,17 @@ def main(args):
             fp.write(strs)
     else:
         final_corrected_sents = predict(
-            **predict_args
+            **predict_args,
+            pipeline_depth=args.pipeline_depth
         )
+        if args.pipeline_depth > 0:
+            overlap = REGISTRY.counter('gector_pipeline_overlap_seconds_total').value
+            print(f'Pipelining overlapped {overlap:.2f}s of collation and alignment with the forward passes.')
     with open(args.out, 'w') as f:
         f.write('\n'.join(final_corrected_sents))
+    if isinstance(model, ReplicaPool):
+        print(json.dumps(model.stats(), indent=2))
+        model.close()
 
 def cli_main():
     args = get_parser()
@@ -172,6 +245,39 @@ def test():
     for hyp, ref in zip(edited_srcs, refs):
         # print(' '.join(hyp), ref)
         assert(' '.join(hyp) == ref)
+    # The same through label ids, as predict() passes them.
+    from gector.modeling import WordLabels
+    id2label = dict(enumerate(sorted(set(l for ls in labels for l in ls))))
+    label2id = {l: i for i, l in id2label.items()}
+    keep_ids = [label2id['$KEEP']]
+    edited_srcs = edit_src_by_tags(
+        srcs,
+        [WordLabels([label2id[l] for l in ls], id2label, keep_ids) for ls in labels],
+        encode, decode
+    )
+    for hyp, ref in zip(edited_srcs, refs):
+        assert(' '.join(hyp) == ref)
+    # Edits of tracked tokens, when the tokens of a word are not next to each other.
+    from gector.predict import _compile_ops
+    from gector.edits import track_src, edit_tracked_tokens_by_tags, extract_edits, diff_edits
+    from gector.segmentation import tokenize_words, project_edits, apply_replacements
+    text = 'a well-known fact'
+    words = text.split(' ')
+    tokens = [stoken] + words
+    tracked = track_src(words)
+    removed = []
+    for tags in ['$KEEP $KEEP $TRANSFORM_SPLIT_HYPHEN $KEEP', '$KEEP $KEEP $APPEND_very $KEEP $KEEP']:
+        tags = tags.split(' ')
+        edited = edit_src_by_tags([tokens], [tags], encode, decode)[0]
+        tracked, removed_tokens = edit_tracked_tokens_by_tags(
+            tracked, _compile_ops(tags, len(tokens)), tags, edited, decode
+        )
+        tokens = edited
+        removed += removed_tokens
+    assert(extract_edits(words, tracked, removed) is None)
+    edits = diff_edits(words, tokens[1:])
+    replacements = project_edits(text, tokenize_words(text), edits)
+    assert(apply_replacements(text, replacements) == 'a well very known fact')
 
 def get_parser():
     parser = argparse.ArgumentParser()
@@ -180,9 +286,44 @@ def get_parser():
     parser.add_argument('--verb_file', default='data/verb-form-vocab.txt')
     parser.add_argument('--n_iteration', type=int, default=5)
     parser.add_argument('--batch_size', type=int, default=128)
+    parser.add_argument(
+        '--max_batch_tokens', type=int,
+        help='The number of padded subwords per batch. The default is batch_size * max_length.'
+    )
+    parser.add_argument(
+        '--pipeline_depth', type=int, default=0,
+        help='If positive, batches are collated and aligned on helper threads during the forward passes, '
+             'with up to this many batches waiting.'
+    )
     parser.add_argument('--keep_confidence', type=float, default=0)
     parser.add_argument('--min_error_prob', type=float, default=0)
     parser.add_argument('--out', default='out.txt')
+    parser.add_argument(
+        '--backend', choices=['torch', 'onnx', 'torchscript'], default='torch',
+        help='With onnx or torchscript, restore_dir is a directory exported by gector-export.'
+    )
+    parser.add_argument(
+        '--precision', choices=['fp32', 'int8', 'bf16'], default='fp32',
+        help='int8 quantizes the Linear layers of the encoder dynamically. Both run on CPU.'
+    )
+    parser.add_argument(
+        '--precision_check', action='store_true',
+        help='Compare --precision with fp32 on --input, and report the agreement and the speedup.'
+    )
+    parser.add_argument(
+        '--stream', action='store_true',
+        help='Read --input in chunks and write --out after each of them, resuming from --checkpoint.'
+    )
+    parser.add_argument('--chunk_size', type=int, default=10000, help='The number of lines per chunk of --stream.')
+    parser.add_argument(
+        '--n_workers', type=int, default=1,
+        help='The number of processes that correct the chunks of --stream, each with its own model.'
+    )
+    parser.add_argument('--checkpoint', help='The checkpoint of --stream. The default is --out + ".ckpt".')
+    parser.add_argument(
+        '--n_replicas', type=int, default=1,
+        help='The number of model replicas in processes pinned to their own cores (CPU only).'
+    )
     parser.add_argument('--test', action='store_true')
     parser.add_argument('--visualize')
     parser.add_argument(
@@ -203,9 +344,15 @@ def get_parser():
     )
     parser.add_argument(
         '--official.max_length', type=int, default=80,
-        help='If the number of subwords is longer than this, it will be truncated.'
+        help='A sentence with more subwords than this is corrected in overlapping windows.'
     )
     args = parser.parse_args()
+    if args.stream and (args.visualize is not None or args.precision_check):
+        parser.error('--stream can not be used with --visualize or --precision_check.')
+    if args.n_replicas > 1 and (args.stream or args.backend != 'torch'):
+        parser.error('--n_replicas is for the torch backend without --stream, use --n_workers with --stream.')
+    if args.backend != 'torch' and (args.precision != 'fp32' or args.precision_check):
+        parser.error('--precision and --precision_check are for the torch backend.')
     return args
 
 if __name__ == '__main__':
@@ -1,8 +1,8 @@
 import argparse
 from gector import (
     GECToR,
-    predict,
-    load_verb_dict
+    load_verb_dict,
+    sweep_thresholds
 )
 from transformers import AutoTokenizer
 import torch
@@ -18,21 +18,27 @@ def main(args):
     encode, decode = load_verb_dict(args.verb_file)
     if torch.cuda.is_available():
         model.cuda()
-    for kc in np.arange(args.kc_min, args.kc_max, args.step):
-        for mep in np.arange(args.mep_min, args.mep_max, args.step):
-            final_corrected_sents = predict(
-                model,
-                tokenizer,
-                srcs,
-                encode,
-                decode,
-                keep_confidence=kc,
-                min_error_prob=mep,
-                batch_size=args.batch_size,
-                n_iteration=args.n_iteration
-            )
-            with open(os.path.join(output_path, f'kc{str(round(kc, 1))}_mep{str(round(mep, 1))}.txt'), 'w') as f:
-                f.write('\n'.join(final_corrected_sents))
+    grid = [
+        (kc, mep)
+        for kc in np.arange(args.kc_min, args.kc_max, args.step)
+        for mep in np.arange(args.mep_min, args.mep_max, args.step)
+    ]
+    # The model outputs are shared by the cells, only the thresholds are applied per cell.
+    outputs, cached = sweep_thresholds(
+        model,
+        tokenizer,
+        srcs,
+        encode,
+        decode,
+        grid,
+        n_workers=args.n_workers,
+        batch_size=args.batch_size,
+        n_iteration=args.n_iteration
+    )
+    for (kc, mep), final_corrected_sents in outputs.items():
+        with open(os.path.join(output_path, f'kc{str(round(kc, 1))}_mep{str(round(mep, 1))}.txt'), 'w') as f:
+            f.write('\n'.join(final_corrected_sents))
+    print(f'{len(grid)} cells, {cached.n_forward} sentences passed to the model, {cached.n_lookup} predicted.')
 
 def cli_main():
     args = get_parser()
@@ -51,6 +57,10 @@ def get_parser():
     parser.add_argument('--mep_max', type=float, default=1)
     parser.add_argument('--step', type=float, default=0.1)
     parser.add_argument('--out', default='out.txt')
+    parser.add_argument(
+        '--n_workers', type=int, default=2,
+        help='The number of threads that run the cells of the grid. On CPU, they share the cores.'
+    )
 
     args = parser.parse_args()
     return args
@@ -0,0 +1,152 @@
+from enum import IntEnum
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+class Op(IntEnum):
+    KEEP = 0
+    APPEND = 1
+    REPLACE = 2
+    DELETE = 3
+    MERGE = 4
+    CASE_LOWER = 5
+    CASE_UPPER = 6
+    CASE_CAPITAL = 7
+    CASE_CAPITAL_1 = 8
+    AGREEMENT_PLURAL = 9
+    AGREEMENT_SINGULAR = 10
+    SPLIT_HYPHEN = 11
+    VERB = 12
+
+TRANSFORM_OPS = {
+    '$TRANSFORM_CASE_LOWER': Op.CASE_LOWER,
+    '$TRANSFORM_CASE_UPPER': Op.CASE_UPPER,
+    '$TRANSFORM_CASE_CAPITAL': Op.CASE_CAPITAL,
+    '$TRANSFORM_CASE_CAPITAL_1': Op.CASE_CAPITAL_1,
+    '$TRANSFORM_AGREEMENT_PLURAL': Op.AGREEMENT_PLURAL,
+    '$TRANSFORM_AGREEMENT_SINGULAR': Op.AGREEMENT_SINGULAR,
+    '$TRANSFORM_SPLIT_HYPHEN': Op.SPLIT_HYPHEN
+}
+
+@lru_cache(maxsize=None)
+def compile_label(label: str) -> Tuple[Op, object]:
+    '''(operation, argument) of a label, decided in the same order as process_token().
+
+    The argument is the list of words to append or replace with for APPEND and REPLACE,
+        the marker token for MERGE, and the verb form key for VERB.
+    '''
+    if '$APPEND_' in label:
+        return Op.APPEND, label.replace('$APPEND_', '').split(' ')
+    elif label in ['<PAD>', '<OOV>', '$KEEP']:
+        return Op.KEEP, None
+    elif '$TRANSFORM_' in label:
+        if label in TRANSFORM_OPS:
+            return TRANSFORM_OPS[label], None
+        return Op.VERB, label[len('$TRANSFORM_VERB_'):]
+    elif '$REPLACE_' in label:
+        return Op.REPLACE, label.replace('$REPLACE_', '').split(' ')
+    elif label == '$DELETE':
+        return Op.DELETE, None
+    elif '$MERGE_' in label:
+        return Op.MERGE, label
+    else:
+        return Op.KEEP, None
+
+_tables = {}
+
+def compile_vocab(id2label: Dict[int, str]) -> List[Optional[Tuple[Op, object]]]:
+    '''The opcode table of a label vocabulary, indexed by label id.
+
+    Labels that keep the token are None, so that they can be skipped quickly.
+        It is compiled once per vocabulary.
+    '''
+    cached = _tables.get(id(id2label))
+    if cached is not None and cached[0] is id2label:
+        return cached[1]
+    table = [None] * (max(id2label) + 1)
+    for i, label in id2label.items():
+        op = compile_label(label)
+        table[i] = op if op[0] is not Op.KEEP else None
+    _tables[id(id2label)] = (id2label, table)
+    return table
+
+def _apply_op(token: str, op: Op, arg, decode: dict) -> List[str]:
+    # The same as process_token(token, label).split(' ') for a label that is not $KEEP.
+    if op is Op.APPEND:
+        return [token] + arg
+    elif token == '$START':
+        return [token]
+    elif op is Op.REPLACE:
+        return arg
+    elif op is Op.DELETE:
+        return ['$DELETE']
+    elif op is Op.MERGE:
+        return [token, arg]
+    elif op is Op.CASE_LOWER:
+        return [token.lower()]
+    elif op is Op.CASE_UPPER:
+        return [token.upper()]
+    elif op is Op.CASE_CAPITAL:
+        return [token.capitalize()]
+    elif op is Op.CASE_CAPITAL_1:
+        if len(token) <= 1:
+            return [token]
+        return [token[0] + token[1:].capitalize()]
+    elif op is Op.AGREEMENT_PLURAL:
+        return [token + 's']
+    elif op is Op.AGREEMENT_SINGULAR:
+        return [token[:-1]]
+    elif op is Op.SPLIT_HYPHEN:
+        return token.split('-')
+    else:
+        decoded = decode.get(f'{token}_{arg}')
+        return [token] if decoded is None else decoded.split(' ')
+
+def _merge_markers(tokens: List[str], marker: str, joiner: str) -> List[str]:
+    # The same as str.replace(f' {marker} ', joiner) on the tokens joined by spaces:
+    #   the marker is merged only if it has a token on both sides, scanning from the left.
+    merged = []
+    i = 0
+    while i < len(tokens):
+        if tokens[i] == marker and merged != [] and i + 1 < len(tokens):
+            merged[-1] = merged[-1] + joiner + tokens[i+1]
+            i += 2
+        else:
+            merged.append(tokens[i])
+            i += 1
+    return merged
+
+def apply_ops(
+    tokens: List[str],
+    ops: Sequence[Tuple[int, Tuple[Op, object]]],
+    decode: dict
+) -> List[str]:
+    '''Edit a sentence by the (position, (operation, argument)) of its words that are not kept.
+
+    The result is the same as the string-based edit_src_by_tags(), including its merge
+        and delete rules, but works on the token list. The string rules are used only when
+        "$DELETE" appears inside a token, which the token rules can not express.
+    '''
+    pieces = []
+    last = 0
+    for i, (op, arg) in ops:
+        pieces += tokens[last:i]
+        pieces += _apply_op(tokens[i], op, arg, decode)
+        last = i + 1
+    pieces += tokens[last:]
+    if '$MERGE_HYPHEN' in pieces:
+        pieces = _merge_markers(pieces, '$MERGE_HYPHEN', '-')
+    if '$MERGE_SPACE' in pieces:
+        pieces = _merge_markers(pieces, '$MERGE_SPACE', '')
+    joined = ' '.join(pieces)
+    n_deletes = joined.count('$DELETE')
+    if n_deletes == 0:
+        return pieces
+    if n_deletes == pieces.count('$DELETE'):
+        # ' $DELETE' removes every marker that is not the first token,
+        #   then '$DELETE ' removes the first one if something follows it.
+        first = pieces[0]
+        pieces = [first] + [p for p in pieces[1:] if p != '$DELETE']
+        if first == '$DELETE' and len(pieces) > 1:
+            pieces = pieces[1:]
+        return pieces
+    return joined.replace(' $DELETE', '').replace('$DELETE ', '').split(' ')
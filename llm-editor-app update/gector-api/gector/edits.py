@@ -0,0 +1,240 @@
+import difflib
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from .edit_ops import Op, _apply_op
+
+START_SOURCE = -1
+
+@dataclass
+class TrackedToken:
+    '''A token of a sentence being corrected, with the source words it derives from.
+
+    sources are indices of the words of the input sentence (START_SOURCE for $START),
+    and is empty for an inserted token. tags are the labels applied to the token so far,
+    and scores their confidences (see WordLabels.score()) if they were predicted.
+    '''
+    text: str
+    sources: Tuple[int, ...]
+    tags: Tuple[str, ...] = ()
+    scores: Tuple[Dict, ...] = ()
+
+def track_src(src: List[str]) -> List[TrackedToken]:
+    '''Tracked tokens of a sentence split into words, with $START prepended.'''
+    return [TrackedToken('$START', (START_SOURCE,))] \
+        + [TrackedToken(word, (i,)) for i, word in enumerate(src)]
+
+def _merge(a: TrackedToken, b: TrackedToken, text: str) -> TrackedToken:
+    sources = tuple(sorted(set(a.sources) | set(b.sources)))
+    return TrackedToken(text, sources, a.tags + b.tags, a.scores + b.scores)
+
+def _resolve_merges(tokens: List[TrackedToken], marker: str, joiner: str) -> List[TrackedToken]:
+    # Mirrors str.replace(f' {marker} ', joiner) of edit_src_by_tags().
+    resolved = []
+    i = 0
+    while i < len(tokens):
+        if tokens[i].text == marker and resolved and i + 1 < len(tokens):
+            prev = resolved.pop()
+            merged = _merge(prev, tokens[i], prev.text)
+            resolved.append(_merge(merged, tokens[i+1], prev.text + joiner + tokens[i+1].text))
+            i += 2
+        else:
+            resolved.append(tokens[i])
+            i += 1
+    return resolved
+
+def edit_tracked_tokens_by_tags(
+    tokens: List[TrackedToken],
+    ops: Sequence[Tuple[int, Tuple[Op, object]]],
+    labels: Sequence[str],
+    edited: List[str],
+    decode: dict,
+    score: Optional[Callable[[int], Optional[Dict]]]=None
+) -> Tuple[Optional[List[TrackedToken]], List[TrackedToken]]:
+    '''Apply the labels to the tracked tokens like edit_src_by_tags().
+
+    Args:
+        tokens: The tracked tokens of a sentence.
+        ops: The (position, (operation, argument)) of the tokens that are not kept,
+            as passed to gector.edit_ops.apply_ops(). The other tokens are not visited.
+        labels: The predicted labels of the tokens, only looked up at the positions of ops.
+        edited: The result of edit_src_by_tags() for the sentence.
+        score: score(i) is the confidence of the i-th label, e.g. WordLabels.score.
+            If None, no scores are kept.
+
+    Returns:
+        The edited tracked tokens, or None if their text does not match edited
+            (then the provenance of the sentence is lost), and the removed tokens.
+    '''
+    pieces = []
+    last = 0
+    for i, (op, arg) in ops:
+        pieces += tokens[last:i]
+        last = i + 1
+        t = tokens[i]
+        words = _apply_op(t.text, op, arg, decode)
+        if ' '.join(words) == t.text:
+            pieces.append(t)
+            continue
+        l = labels[i]
+        scores = () if score is None else (score(i),)
+        if op is Op.APPEND:
+            pieces.append(TrackedToken(words[0], t.sources, t.tags, t.scores))
+            pieces += [TrackedToken(w, (), (l,), scores) for w in words[1:]]
+        elif op is Op.DELETE:
+            pieces.append(TrackedToken('$DELETE', t.sources, t.tags + (l,), t.scores + scores))
+        elif op is Op.MERGE:
+            pieces.append(t)
+            pieces.append(TrackedToken(l, (), (l,), scores))
+        else:
+            pieces += [TrackedToken(w, t.sources, t.tags + (l,), t.scores + scores) for w in words]
+    pieces += tokens[last:]
+    pieces = _resolve_merges(pieces, '$MERGE_HYPHEN', '-')
+    pieces = _resolve_merges(pieces, '$MERGE_SPACE', '')
+    result = []
+    removed = []
+    for i, t in enumerate(pieces):
+        # ' $DELETE' and then '$DELETE ' are removed from the joined string.
+        if t.text == '$DELETE' and (i > 0 or len(pieces) > 1):
+            removed.append(t)
+        else:
+            result.append(t)
+    if [t.text for t in result] != edited:
+        return None, removed
+    return result, removed
+
+def _edit(type: str, start: int, end: int, corrected: str, tags: List[str], scores: List[Dict]=None) -> Dict:
+    edit = {'type': type, 'start': start, 'end': end, 'corrected': corrected, 'tags': tags}
+    if scores:
+        edit['scores'] = scores
+    return edit
+
+def _unique(tags) -> List[str]:
+    return list(dict.fromkeys(tags))
+
+def _unique_scores(scores) -> List[Dict]:
+    # A token that was split or merged carries the same score more than once.
+    unique = {}
+    for score in scores:
+        if score is not None:
+            unique.setdefault(id(score), score)
+    return list(unique.values())
+
+def extract_edits(
+    src: List[str],
+    tokens: List[TrackedToken],
+    removed: List[TrackedToken]
+) -> Optional[List[Dict]]:
+    '''Edits that turn the source words into the tracked tokens.
+
+    An edit is a dict of
+        type: "replace", "transform", "insert" or "delete".
+        start, end: The range of source word indices that are edited (start == end for "insert",
+            which inserts before the start-th word).
+        corrected: The new text of the range.
+        tags: The labels that caused the edit, in the order they were applied.
+        scores: The confidences of the labels (see WordLabels.score()), only if they were tracked.
+
+    Returns None if the provenance is inconsistent, e.g. a word was merged into $START,
+        or the tokens of a word are not next to each other.
+    '''
+    if tokens == [] or tokens[0].sources != (START_SOURCE,) or tokens[0].text != '$START':
+        return None
+    tokens = tokens[1:]
+    if any(START_SOURCE in t.sources for t in tokens):
+        return None
+    edits = []
+    covered = set()
+    next_word = 0
+    i = 0
+    while i < len(tokens):
+        if tokens[i].sources == ():
+            j = i
+            while j < len(tokens) and tokens[j].sources == ():
+                j += 1
+            group = tokens[i:j]
+            corrected = ' '.join(t.text for t in group if t.text != '')
+            if corrected != '':
+                edits.append(_edit(
+                    'insert', next_word, next_word, corrected,
+                    _unique(tag for t in group for tag in t.tags),
+                    _unique_scores(sc for t in group for sc in t.scores)
+                ))
+            i = j
+            continue
+        sources = set(tokens[i].sources)
+        j = i + 1
+        while j < len(tokens) and sources & set(tokens[j].sources):
+            sources |= set(tokens[j].sources)
+            j += 1
+        group = tokens[i:j]
+        start, end = min(sources), max(sources) + 1
+        if covered & set(range(start, end)):
+            # The words were edited apart, e.g. split and then appended to in the middle,
+            #   so the edits would overlap.
+            return None
+        covered |= set(range(start, end))
+        # A token can become empty, e.g. "a" by $TRANSFORM_AGREEMENT_SINGULAR.
+        corrected = ' '.join(t.text for t in group if t.text != '')
+        tags = _unique(tag for t in group for tag in t.tags)
+        scores = _unique_scores(sc for t in group for sc in t.scores)
+        if corrected == '':
+            edits.append(_edit('delete', start, end, '', tags, scores))
+        elif corrected != ' '.join(src[start:end]):
+            is_transform = len(group) == 1 and end - start == 1 \
+                and tags != [] and all(tag.startswith('$TRANSFORM_') for tag in tags)
+            edits.append(_edit('transform' if is_transform else 'replace', start, end, corrected, tags, scores))
+        next_word = max(next_word, end)
+        i = j
+    removed_tags = {}
+    removed_scores = {}
+    for t in removed:
+        for s in t.sources:
+            removed_tags.setdefault(s, []).extend(t.tags)
+            removed_scores.setdefault(s, []).extend(t.scores)
+    start = None
+    for k in range(len(src) + 1):
+        if k < len(src) and k not in covered:
+            if start is None:
+                start = k
+        elif start is not None:
+            tags = _unique(tag for s in range(start, k) for tag in removed_tags.get(s, []))
+            scores = _unique_scores(sc for s in range(start, k) for sc in removed_scores.get(s, []))
+            edits.append(_edit('delete', start, k, '', tags, scores))
+            start = None
+    edits.sort(key=lambda e: (e['start'], e['end']))
+    return _merge_adjacent(edits)
+
+def _merge_adjacent(edits: List[Dict]) -> List[Dict]:
+    # A deletion next to an insertion is a replacement, e.g. $DELETE on a word and $APPEND_ on the previous one.
+    #   Adjacent deletions are one deletion, so that their separating spaces are not removed twice.
+    merged = []
+    for e in edits:
+        prev = merged[-1] if merged else None
+        if prev is not None and {prev['type'], e['type']} == {'insert', 'delete'} \
+                and prev['end'] == e['start']:
+            corrected = prev['corrected'] or e['corrected']
+            merged[-1] = _edit(
+                'replace', prev['start'], e['end'], corrected, _unique(prev['tags'] + e['tags']),
+                _unique_scores(prev.get('scores', []) + e.get('scores', []))
+            )
+        elif prev is not None and prev['type'] == e['type'] == 'delete' and prev['end'] == e['start']:
+            merged[-1] = _edit(
+                'delete', prev['start'], e['end'], '', _unique(prev['tags'] + e['tags']),
+                _unique_scores(prev.get('scores', []) + e.get('scores', []))
+            )
+        else:
+            merged.append(e)
+    return merged
+
+def diff_edits(src: List[str], corrected: List[str]) -> List[Dict]:
+    '''Edits between the source words and the corrected words by a word-level diff.
+
+    Used when the provenance of tokens is not available. The tags are unknown.
+    '''
+    edits = []
+    matcher = difflib.SequenceMatcher(a=src, b=corrected, autojunk=False)
+    for op, i1, i2, j1, j2 in matcher.get_opcodes():
+        if op == 'equal':
+            continue
+        edits.append(_edit(op, i1, i2, ' '.join(corrected[j1:j2]), []))
+    return edits
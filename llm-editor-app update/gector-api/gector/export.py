@@ -0,0 +1,248 @@
+import inspect
+import os
+import time
+import torch
+import torch.nn as nn
+from typing import Dict, List, Optional
+from transformers import PreTrainedTokenizer
+from .configuration import GECToRConfig
+from .modeling import GECToR, GECToRPredictionOutput, predict_from_logits
+from .tokenization import get_incremental_encoder, first_subword_index
+
+ONNX_FILE = 'model.onnx'
+TORCHSCRIPT_FILE = 'model.pt'
+BACKENDS = {'onnx': ONNX_FILE, 'torchscript': TORCHSCRIPT_FILE}
+
+class _GECToRGraph(nn.Module):
+    # The encoder and both projection heads with plain tensor outputs, for tracing.
+    def __init__(self, model: GECToR):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids: torch.Tensor, attention_mask: torch.Tensor):
+        outputs = self.model(input_ids, attention_mask)
+        return outputs.logits_labels, outputs.logits_d
+
+def _example_inputs(model: GECToR):
+    # The values do not matter, the axes of the batch and the sequence are dynamic.
+    input_ids = torch.randint(5, 100, (2, 16), device=model.device)
+    attention_mask = torch.ones_like(input_ids)
+    return input_ids, attention_mask
+
+def _save_metadata(
+    model: GECToR,
+    tokenizer: Optional[PreTrainedTokenizer],
+    out_dir: str
+) -> None:
+    # The config (labels, max_length) and the tokenizer make out_dir self-contained.
+    model.config.save_pretrained(out_dir)
+    if tokenizer is not None:
+        tokenizer.save_pretrained(out_dir)
+
+def export_onnx(
+    model: GECToR,
+    out_dir: str,
+    tokenizer: Optional[PreTrainedTokenizer]=None,
+    opset_version: int=14
+) -> str:
+    '''Export the encoder and both heads of GECToR to out_dir/model.onnx.
+
+    The graph takes input_ids and attention_mask of shape (batch, seq_len) and returns
+        logits_labels and logits_d, with dynamic batch and sequence axes.
+        The post-processing of GECToR.predict() stays in Python, see ExportedGECToR.
+
+    Returns:
+        The path of the exported file.
+    '''
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, ONNX_FILE)
+    graph = _GECToRGraph(model).eval()
+    kwargs = {}
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        # Newer versions of torch default to the dynamo exporter, which ignores dynamic_axes.
+        kwargs['dynamo'] = False
+    with torch.no_grad():
+        torch.onnx.export(
+            graph,
+            _example_inputs(model),
+            path,
+            input_names=['input_ids', 'attention_mask'],
+            output_names=['logits_labels', 'logits_d'],
+            dynamic_axes={
+                'input_ids': {0: 'batch', 1: 'sequence'},
+                'attention_mask': {0: 'batch', 1: 'sequence'},
+                'logits_labels': {0: 'batch', 1: 'sequence'},
+                'logits_d': {0: 'batch', 1: 'sequence'}
+            },
+            opset_version=opset_version,
+            **kwargs
+        )
+    _save_metadata(model, tokenizer, out_dir)
+    return path
+
+def export_torchscript(
+    model: GECToR,
+    out_dir: str,
+    tokenizer: Optional[PreTrainedTokenizer]=None
+) -> str:
+    '''Export the encoder and both heads of GECToR to out_dir/model.pt by tracing.
+
+    The inputs and outputs are the same as export_onnx().
+
+    Returns:
+        The path of the exported file.
+    '''
+    os.makedirs(out_dir, exist_ok=True)
+    path = os.path.join(out_dir, TORCHSCRIPT_FILE)
+    graph = _GECToRGraph(model).eval()
+    with torch.no_grad():
+        traced = torch.jit.trace(graph, _example_inputs(model), strict=False)
+    traced.save(path)
+    _save_metadata(model, tokenizer, out_dir)
+    return path
+
+class ExportedGECToR:
+    '''Run a graph exported by export_onnx() or export_torchscript() on CPU.
+
+    It can be passed to predict() and the other functions that take a GECToR,
+        which only use config and predict().
+
+    Args:
+        path (str): The directory of the exported graph.
+        backend (str): "onnx" or "torchscript". If None, it is decided by the file in path.
+        num_threads (int): The number of intra-op threads. If None, the default of the runtime.
+    '''
+    def __init__(
+        self,
+        path: str,
+        backend: Optional[str]=None,
+        num_threads: Optional[int]=None
+    ):
+        if backend is None:
+            backend = next(
+                (b for b, f in BACKENDS.items() if os.path.exists(os.path.join(path, f))),
+                None
+            )
+            if backend is None:
+                raise FileNotFoundError(f'{path} contains neither {ONNX_FILE} nor {TORCHSCRIPT_FILE}.')
+        if backend not in BACKENDS:
+            raise ValueError(f'Unknown backend: {backend}. Choose from {list(BACKENDS)}.')
+        self.backend = backend
+        self.config = GECToRConfig.from_pretrained(path)
+        self.device = torch.device('cpu')
+        file = os.path.join(path, BACKENDS[backend])
+        if backend == 'onnx':
+            import onnxruntime
+            options = onnxruntime.SessionOptions()
+            if num_threads is not None:
+                options.intra_op_num_threads = num_threads
+            self._session = onnxruntime.InferenceSession(
+                file, options, providers=['CPUExecutionProvider']
+            )
+        else:
+            if num_threads is not None:
+                torch.set_num_threads(num_threads)
+            self._module = torch.jit.load(file, map_location='cpu').eval()
+
+    def eval(self) -> 'ExportedGECToR':
+        return self
+
+    def logits(self, input_ids: torch.Tensor, attention_mask: torch.Tensor):
+        '''(logits_labels, logits_d) of the encoder and the heads.'''
+        input_ids = input_ids.cpu()
+        attention_mask = attention_mask.cpu()
+        if self.backend == 'onnx':
+            logits_labels, logits_d = self._session.run(
+                ['logits_labels', 'logits_d'],
+                {'input_ids': input_ids.numpy(), 'attention_mask': attention_mask.numpy()}
+            )
+            return torch.from_numpy(logits_labels), torch.from_numpy(logits_d)
+        with torch.no_grad():
+            return self._module(input_ids, attention_mask)
+
+    def predict(
+        self,
+        input_ids: torch.Tensor,
+        attention_mask: torch.Tensor,
+        word_masks: torch.Tensor,
+        keep_confidence: float=0,
+        min_error_prob: float=0,
+        word_index: Optional[torch.Tensor]=None,
+        return_labels: bool=True,
+        top_k: int=0
+    ) -> GECToRPredictionOutput:
+        '''The same as GECToR.predict().'''
+        logits_labels, logits_d = self.logits(input_ids, attention_mask)
+        with torch.no_grad():
+            return predict_from_logits(
+                self.config,
+                logits_labels,
+                logits_d,
+                word_masks.cpu(),
+                keep_confidence,
+                min_error_prob,
+                word_index=None if word_index is None else word_index.cpu(),
+                return_labels=return_labels,
+                top_k=top_k
+            )
+
+def check_parity(
+    model: GECToR,
+    exported: ExportedGECToR,
+    tokenizer: PreTrainedTokenizer,
+    srcs: List[str],
+    batch_size: int=32
+) -> Dict[str, float]:
+    '''Compare an exported graph with the PyTorch model on the sentences.
+
+    Returns:
+        max_abs_diff_labels, max_abs_diff_d: The maximum absolute differences of the
+            tag and the detection probabilities over the words.
+        tag_agreement: The fraction of words with the same predicted tag.
+        n_words: The number of compared words.
+        torch_seconds, exported_seconds: The time of the forward passes.
+    '''
+    encoder = get_incremental_encoder(tokenizer)
+    result = {
+        'max_abs_diff_labels': 0.0,
+        'max_abs_diff_d': 0.0,
+        'tag_agreement': 0.0,
+        'n_words': 0,
+        'torch_seconds': 0.0,
+        'exported_seconds': 0.0
+    }
+    n_agree = 0
+    for i in range(0, len(srcs), batch_size):
+        words = [['$START'] + src.split(' ') for src in srcs[i:i+batch_size]]
+        input_ids, word_ids = encoder.encode(
+            words,
+            max_length=model.config.max_length,
+            add_special_tokens=not model.config.is_official_model
+        )
+        batch = encoder.build_batch(input_ids, word_ids)
+        index, valid = first_subword_index(batch['word_ids'])
+        outputs = {}
+        for name, m in [('torch', model), ('exported', exported)]:
+            inputs = {k: v.to(m.device) for k, v in batch.items()}
+            start = time.perf_counter()
+            outputs[name] = m.predict(
+                inputs['input_ids'],
+                inputs['attention_mask'],
+                inputs['word_masks'],
+                word_index=index.to(m.device),
+                return_labels=False
+            )
+            result[f'{name}_seconds'] += time.perf_counter() - start
+        ref, out = outputs['torch'], outputs['exported']
+        word_mask = torch.zeros_like(batch['attention_mask'], dtype=torch.bool)
+        word_mask.scatter_(1, index, valid)
+        if not word_mask.any():
+            # No words to compare, e.g. a batch of empty lines.
+            continue
+        for key, name in [('max_abs_diff_labels', 'probability_labels'), ('max_abs_diff_d', 'probability_d')]:
+            diff = (getattr(ref, name).cpu() - getattr(out, name)).abs().amax(dim=-1)
+            result[key] = max(result[key], float(diff[word_mask].max()))
+        n_agree += int(((ref.word_label_ids.cpu() == out.word_label_ids) & valid).sum())
+        result['n_words'] += int(valid.sum())
+    result['tag_agreement'] = n_agree / max(result['n_words'], 1)
+    return result
@@ -0,0 +1,146 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds.
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+def _format_labels(labels: Tuple[Tuple[str, str], ...], extra: Optional[Tuple[str, str]]=None) -> str:
+    items = list(labels) + ([extra] if extra is not None else [])
+    if items == []:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in items) + '}'
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, labels: Tuple[Tuple[str, str], ...]):
+        self.labels = labels
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, n: float=1) -> None:
+        with self._lock:
+            self.value += n
+
+    def samples(self, name: str) -> List[str]:
+        return [f'{name}{_format_labels(self.labels)} {_format_value(self.value)}']
+
+class Gauge(Counter):
+    def set(self, value: float) -> None:
+        with self._lock:
+            self.value = value
+
+class Histogram:
+    def __init__(self, labels: Tuple[Tuple[str, str], ...], buckets: Sequence[float]):
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # The last one is +Inf.
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    @contextmanager
+    def time(self):
+        '''Observe the elapsed seconds of the with-block.'''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def samples(self, name: str) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += n
+            lines.append(
+                f'{name}_bucket{_format_labels(self.labels, ("le", _format_value(float(bound))))} {cumulative}'
+            )
+        lines.append(f'{name}_sum{_format_labels(self.labels)} {_format_value(self.sum)}')
+        lines.append(f'{name}_count{_format_labels(self.labels)} {self.count}')
+        return lines
+
+class Registry:
+    '''A set of metrics that can be rendered in the Prometheus text format.
+
+    Metrics are created on first use and identified by their name and labels,
+    e.g. registry.histogram('gector_stage_seconds', 'Time per stage', stage='forward').
+    '''
+    def __init__(self):
+        self._metrics: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, kind: str, name: str, help: str, labels: Dict[str, str], **kwargs):
+        key = tuple(sorted(labels.items()))
+        family = self._metrics.get(name)
+        if family is not None:
+            metric = family['children'].get(key)
+            if metric is not None:
+                return metric
+        with self._lock:
+            family = self._metrics.setdefault(
+                name, {'kind': kind, 'help': help, 'children': {}}
+            )
+            if family['kind'] != kind:
+                raise ValueError(f'{name} is already registered as a {family["kind"]}.')
+            if key not in family['children']:
+                if kind == 'histogram':
+                    family['children'][key] = Histogram(key, **kwargs)
+                elif kind == 'gauge':
+                    family['children'][key] = Gauge(key)
+                else:
+                    family['children'][key] = Counter(key)
+            return family['children'][key]
+
+    def counter(self, name: str, help: str='', **labels) -> Counter:
+        return self._get('counter', name, help, labels)
+
+    def gauge(self, name: str, help: str='', **labels) -> Gauge:
+        return self._get('gauge', name, help, labels)
+
+    def histogram(
+        self,
+        name: str,
+        help: str='',
+        buckets: Sequence[float]=LATENCY_BUCKETS,
+        **labels
+    ) -> Histogram:
+        return self._get('histogram', name, help, labels, buckets=buckets)
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            families = [(name, dict(f, children=dict(f['children']))) for name, f in self._metrics.items()]
+        for name, family in sorted(families):
+            lines.append(f'# HELP {name} {family["help"]}')
+            lines.append(f'# TYPE {name} {family["kind"]}')
+            for _, metric in sorted(family['children'].items()):
+                lines += metric.samples(name)
+        return '\n'.join(lines) + '\n'
+
+# The registry used by the gector package and the API server.
+REGISTRY = Registry()
+
+def stage_timer(stage: str) -> Histogram:
+    '''The latency histogram of a processing stage, e.g. "tokenize" or "forward".'''
+    return REGISTRY.histogram(
+        'gector_stage_seconds',
+        'Time spent in each processing stage',
+        stage=stage
+    )
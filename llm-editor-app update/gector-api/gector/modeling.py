@@ -5,7 +5,7 @@ import torch.nn as nn
 from torch.nn import CrossEntropyLoss
 from dataclasses import dataclass
 from .configuration import GECToRConfig
-from typing import List, Union, Optional, Tuple
+from typing import Dict, Iterator, List, Sequence, Union, Optional, Tuple
 from .vocab import load_vocab_from_official
 from .utils import has_args_add_pooling
 import pprint
@@ -27,6 +27,167 @@ class GECToRPredictionOutput:
     pred_labels: List[List[str]] = None
     pred_label_ids: torch.Tensor = None
     max_error_probability: torch.Tensor = None
+    # (batch, max_words) at the first subword of each word, only if word_index is given.
+    word_label_ids: torch.Tensor = None
+    word_error_probability: torch.Tensor = None
+    # Only if top_k > 0: the probability of the predicted label (without the $KEEP bias),
+    #   and the top_k labels with their probabilities, (batch, max_words, top_k).
+    word_label_probability: torch.Tensor = None
+    word_topk_ids: torch.Tensor = None
+    word_topk_probability: torch.Tensor = None
+
+class WordLabels(Sequence):
+    '''Word-level labels of a sentence, kept as label ids and mapped to strings on access.
+
+    Iterating over it yields the label strings, so it can be used in place of List[str].
+    Use corrections() to look at the words whose label is not one of keep_ids,
+        e.g. the ids of $KEEP, <OOV> and <PAD>, without mapping the others.
+    '''
+    __slots__ = ('ids', 'id2label', 'keep_ids', 'scores')
+
+    def __init__(
+        self,
+        ids: List[int],
+        id2label: Dict[int, str],
+        keep_ids: Sequence[int]=(),
+        scores: Optional[List[Tuple[float, float, List[int], List[float]]]]=None
+    ):
+        self.ids = ids
+        self.id2label = id2label
+        self.keep_ids = frozenset(keep_ids)
+        # (label probability, error probability, top-k ids, top-k probabilities) of each word.
+        self.scores = scores
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            scores = None if self.scores is None else self.scores[i]
+            return WordLabels(self.ids[i], self.id2label, self.keep_ids, scores)
+        return self.id2label[self.ids[i]]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __eq__(self, other) -> bool:
+        return list(self) == list(other)
+
+    def __repr__(self) -> str:
+        return repr(list(self))
+
+    def corrections(self) -> Iterator[Tuple[int, str]]:
+        '''(word index, label) of the words whose label id is not in keep_ids.'''
+        for i, _id in enumerate(self.ids):
+            if _id not in self.keep_ids:
+                yield i, self.id2label[_id]
+
+    def score(self, i: int) -> Optional[Dict]:
+        '''The confidence of the label of the i-th word, None if the scores were not predicted.
+
+        Returns:
+            A dict of tag, probability (of the tag), error_probability (of the detection head)
+                and alternatives, the top-k tags with their probabilities.
+        '''
+        if self.scores is None:
+            return None
+        probability, error_probability, topk_ids, topk_probability = self.scores[i]
+        return {
+            'tag': self.id2label[self.ids[i]],
+            'probability': probability,
+            'error_probability': error_probability,
+            'alternatives': [
+                {'tag': self.id2label[_id], 'probability': p}
+                for _id, p in zip(topk_ids, topk_probability)
+            ]
+        }
+
+def predict_from_logits(
+    config: GECToRConfig,
+    logits_labels: torch.Tensor,
+    logits_d: torch.Tensor,
+    word_masks: torch.Tensor,
+    keep_confidence: float=0,
+    min_error_prob: float=0,
+    word_index: Optional[torch.Tensor]=None,
+    return_labels: bool=True,
+    top_k: int=0
+) -> GECToRPredictionOutput:
+    '''The prediction of GECToR.predict() from the logits of both heads.
+
+    Shared by GECToR and the exported graphs (gector.export), which compute the logits
+        of the encoder and the heads without the PyTorch model.
+    '''
+    # (batch, seq_len, num_labels)
+    probability_labels = F.softmax(logits_labels, dim=-1)
+    # (batch, seq_len, num_labels)
+    probability_d = F.softmax(logits_d, dim=-1)
+    word_probability = None
+    if word_index is not None and top_k > 0:
+        # A copy at the words, before the bias is added in place.
+        word_probability = probability_labels.gather(
+            1, word_index.unsqueeze(-1).expand(-1, -1, probability_labels.size(-1))
+        )
+
+    # Apply the bias of $KEEP.
+    keep_index = config.label2id[config.keep_label]
+    probability_labels[:, :, keep_index] += keep_confidence
+    # Get predcition tags. (batch, seq_len, num_labels) -> (batch, seq_len)
+    pred_label_ids = torch.argmax(probability_labels, dim=-1)
+
+    # Apply the minimum error probability threshold
+    incor_idx = config.d_label2id[config.incorrect_label]
+    # (batch_size, seq_len, num_labels) -> (batch_size, seq_len)
+    probability_d_incor = probability_d[:, :, incor_idx]
+    # (batch_size, seq_len) -> (batch_size)
+    max_error_probability = torch.max(probability_d_incor * word_masks, dim=-1)[0]
+    # Sentence-level threshold.
+    #   Set the $KEEP tag to all tokens in the sentences 
+    #   that have lower maximum error prob. than thredhold.
+    pred_label_ids[
+        max_error_probability < min_error_prob, :
+    ] = keep_index
+    # Token-level threshold.
+    #   Set infinity to tokens that have lower probability than thredhold.
+    #   Note that the probaility is not detection's, but tag's one.
+    pred_label_ids[
+        torch.max(probability_labels, dim=-1)[0] < min_error_prob
+    ] = keep_index
+
+    def convert_ids_to_labels(ids, id2label):
+        labels = []
+        for id in ids.tolist():
+            labels.append(id2label[id])
+        return labels
+
+    pred_labels = None
+    if return_labels:
+        pred_labels = []
+        for ids in pred_label_ids:
+            labels = convert_ids_to_labels(
+                ids,
+                config.id2label
+            )
+            pred_labels.append(labels)
+    word_label_ids, word_error_probability = None, None
+    if word_index is not None:
+        word_label_ids = pred_label_ids.gather(1, word_index)
+        word_error_probability = probability_d_incor.gather(1, word_index)
+    word_label_probability, word_topk_ids, word_topk_probability = None, None, None
+    if word_probability is not None:
+        word_label_probability = word_probability.gather(2, word_label_ids.unsqueeze(-1)).squeeze(-1)
+        word_topk_probability, word_topk_ids = torch.topk(
+            word_probability, min(top_k, word_probability.size(-1)), dim=-1
+        )
+    return GECToRPredictionOutput(
+        probability_labels=probability_labels,
+        probability_d=probability_d,
+        pred_labels=pred_labels,
+        pred_label_ids=pred_label_ids,
+        max_error_probability=max_error_probability,
+        word_label_ids=word_label_ids,
+        word_error_probability=word_error_probability,
+        word_label_probability=word_label_probability,
+        word_topk_ids=word_topk_ids,
+        word_topk_probability=word_topk_probability
+    )
 
 class GECToR(PreTrainedModel):
     config_class = GECToRConfig
@@ -155,63 +316,39 @@ class GECToR(PreTrainedModel):
         attention_mask: torch.Tensor,
         word_masks: torch.Tensor,
         keep_confidence: float=0,
-        min_error_prob: float=0
-    ): 
+        min_error_prob: float=0,
+        word_index: Optional[torch.Tensor]=None,
+        return_labels: bool=True,
+        top_k: int=0
+    ) -> GECToRPredictionOutput:
+        '''Predict the labels of the subwords.
+
+        Args:
+            word_index (torch.Tensor): (batch, max_words) positions of the first subword of
+                each word. If given, word_label_ids and word_error_probability are gathered
+                at these positions, so that callers do not have to handle (batch, seq_len) tensors.
+            return_labels (bool): If False, pred_labels (the label strings of all positions,
+                padding included) is not built. Use word_label_ids and WordLabels instead.
+            top_k (int): If positive and word_index is given, the probability of the predicted
+                label and the top_k labels of each word are also returned.
+        '''
         with torch.no_grad():
             outputs = self.forward(
                 input_ids,
                 attention_mask
             )
-            # (batch, seq_len, num_labels)
-            probability_labels = F.softmax(outputs.logits_labels, dim=-1)
-            # (batch, seq_len, num_labels)
-            probability_d = F.softmax(outputs.logits_d, dim=-1)
-
-            # Apply the bias of $KEEP.
-            keep_index = self.config.label2id[self.config.keep_label]
-            probability_labels[:, :, keep_index] += keep_confidence
-            # Get predcition tags. (batch, seq_len, num_labels) -> (batch, seq_len)
-            pred_label_ids = torch.argmax(probability_labels, dim=-1)
-
-            # Apply the minimum error probability threshold
-            incor_idx = self.config.d_label2id[self.config.incorrect_label]
-            # (batch_size, seq_len, num_labels) -> (batch_size, seq_len)
-            probability_d_incor = probability_d[:, :, incor_idx]
-            # (batch_size, seq_len) -> (batch_size)
-            max_error_probability = torch.max(probability_d_incor * word_masks, dim=-1)[0]
-            # Sentence-level threshold.
-            #   Set the $KEEP tag to all tokens in the sentences 
-            #   that have lower maximum error prob. than thredhold.
-            pred_label_ids[
-                max_error_probability < min_error_prob, :
-            ] = keep_index
-            # Token-level threshold.
-            #   Set infinity to tokens that have lower probability than thredhold.
-            #   Note that the probaility is not detection's, but tag's one.
-            pred_label_ids[
-                torch.max(probability_labels, dim=-1)[0] < min_error_prob
-            ] = keep_index
-
-            def convert_ids_to_labels(ids, id2label):
-                labels = []
-                for id in ids.tolist():
-                    labels.append(id2label[id])
-                return labels
-
-            pred_labels = []
-            for ids in pred_label_ids:
-                labels = convert_ids_to_labels(
-                    ids,
-                    self.config.id2label
-                )
-                pred_labels.append(labels)
-        return GECToRPredictionOutput(
-            probability_labels=probability_labels,
-            probability_d=probability_d,
-            pred_labels=pred_labels,
-            pred_label_ids=pred_label_ids,
-            max_error_probability=max_error_probability
-        )
+            # The logits are fp32 also when the model runs in bf16.
+            return predict_from_logits(
+                self.config,
+                outputs.logits_labels.float(),
+                outputs.logits_d.float(),
+                word_masks,
+                keep_confidence,
+                min_error_prob,
+                word_index=word_index,
+                return_labels=return_labels,
+                top_k=top_k
+            )
     
     @classmethod
     def from_official_pretrained(
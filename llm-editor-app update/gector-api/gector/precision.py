@@ -0,0 +1,99 @@
+import copy
+import time
+import torch
+import torch.nn as nn
+from typing import Dict, List
+from transformers import PreTrainedTokenizer
+from .modeling import GECToR
+from .predict import predict, _predict
+
+PRECISIONS = ('fp32', 'int8', 'bf16')
+
+def bf16_supported() -> bool:
+    '''Whether the CPU runs bf16 natively. Otherwise bf16 is emulated and slower than fp32.'''
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+def set_precision(model: GECToR, precision: str) -> GECToR:
+    '''A copy of the model for CPU inference in the precision.
+
+    Args:
+        precision (str):
+            "fp32": The model itself.
+            "int8": The Linear layers of the encoder are quantized dynamically, i.e. the weights
+                are int8 and the activations are quantized per batch. The heads stay fp32.
+            "bf16": All the weights are bf16. The logits are converted back to fp32 by GECToR.predict().
+
+    Raises:
+        ValueError: If the precision is unknown, or bf16 is not supported by the CPU.
+    '''
+    if precision not in PRECISIONS:
+        raise ValueError(f'Unknown precision: {precision}. Choose from {list(PRECISIONS)}.')
+    if precision == 'fp32':
+        return model
+    if precision == 'bf16' and not bf16_supported():
+        raise ValueError('bf16 is not supported by this CPU.')
+    model = copy.deepcopy(model).cpu().eval()
+    if precision == 'int8':
+        model.bert = torch.quantization.quantize_dynamic(
+            model.bert, {nn.Linear}, dtype=torch.qint8
+        )
+    else:
+        model.to(torch.bfloat16)
+    return model
+
+def compare_precision(
+    model: GECToR,
+    tokenizer: PreTrainedTokenizer,
+    srcs: List[str],
+    encode: dict,
+    decode: dict,
+    precision: str,
+    **predict_args
+) -> Dict[str, float]:
+    '''Compare a precision with fp32 on held-out sentences.
+
+    Both models correct srcs by predict() with predict_args.
+
+    Returns:
+        tag_agreement: The fraction of words with the same tag in the first iteration.
+        sentence_agreement: The fraction of sentences with the same corrected output.
+        changed_sentences: The number of sentences whose corrected output differs.
+        fp32_seconds, seconds: The time of predict().
+        speedup: fp32_seconds / seconds.
+    '''
+    reduced = set_precision(model, precision)
+    model = model.cpu().eval()
+    words = [['$START'] + src.split(' ') for src in srcs]
+    # The tags of the first iteration, chosen with the same thresholds as predict().
+    label_args = dict(
+        keep_confidence=predict_args.get('keep_confidence', 0),
+        min_error_prob=predict_args.get('min_error_prob', 0),
+        batch_size=predict_args.get('batch_size', 128),
+        max_batch_tokens=predict_args.get('max_batch_tokens')
+    )
+    ref_labels, _ = _predict(model, tokenizer, words, **label_args)
+    labels, _ = _predict(reduced, tokenizer, words, **label_args)
+    n_words = sum(len(l) for l in ref_labels)
+    n_agree = sum(
+        sum(a == b for a, b in zip(ref.ids, out.ids))
+        for ref, out in zip(ref_labels, labels)
+    )
+    seconds = {}
+    outputs = {}
+    for name, m in [('fp32', model), (precision, reduced)]:
+        start = time.perf_counter()
+        outputs[name] = predict(m, tokenizer, srcs, encode, decode, **predict_args)
+        seconds[name] = time.perf_counter() - start
+    n_same = sum(a == b for a, b in zip(outputs['fp32'], outputs[precision]))
+    return {
+        'precision': precision,
+        'tag_agreement': n_agree / max(n_words, 1),
+        'sentence_agreement': n_same / max(len(srcs), 1),
+        'changed_sentences': len(srcs) - n_same,
+        'fp32_seconds': seconds['fp32'],
+        'seconds': seconds[precision],
+        'speedup': seconds['fp32'] / seconds[precision]
+    }
@@ -1,9 +1,38 @@
 import torch
 import os
+import functools
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
 from tqdm import tqdm
-from .modeling import GECToR
+from .modeling import GECToR, WordLabels
+from .metrics import REGISTRY, stage_timer
+from .edit_ops import Op, apply_ops, compile_label, compile_vocab
+from .tokenization import (
+    get_incremental_encoder,
+    word_ids_to_tensor,
+    word_masks_from_word_ids,
+    first_subword_index,
+    make_windows,
+    window_centrality
+)
+from .edits import (
+    TrackedToken,
+    track_src,
+    edit_tracked_tokens_by_tags,
+    extract_edits,
+    diff_edits
+)
 from transformers import PreTrainedTokenizer
-from typing import List
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+LENGTH_BUCKETS = (8, 16, 32, 64, 80, 128, 256, 512)
 
 def load_verb_dict(verb_file: str):
     path_to_dict = os.path.join(verb_file)
@@ -25,25 +54,35 @@ def edit_src_by_tags(
     encode: dict,
     decode: dict
 ) -> List[str]:
+    '''Apply the predicted labels to the tokens.
+
+    Labels are compiled into (operation, argument) once, see gector.edit_ops,
+        and only the words whose label is not $KEEP are edited.
+    '''
     edited_srcs = []
     for tokens, labels in zip(srcs, pred_labels):
-        edited_tokens = []
-        for t, l, in zip(tokens, labels):
-            n_token = process_token(t, l, encode, decode)
-            if n_token == None:
-                n_token = t
-            edited_tokens += n_token.split(' ')
-        if len(tokens) > len(labels):
-            omitted_tokens = tokens[len(labels):]
-            edited_tokens += omitted_tokens
-        temp_str = ' '.join(edited_tokens) \
-            .replace(' $MERGE_HYPHEN ', '-') \
-            .replace(' $MERGE_SPACE ', '') \
-            .replace(' $DELETE', '') \
-            .replace('$DELETE ', '')
-        edited_srcs.append(temp_str.split(' '))
+        edited_srcs.append(apply_ops(tokens, _compile_ops(labels, len(tokens)), decode))
     return edited_srcs
 
+def _compile_ops(
+    labels: List[str],
+    n_tokens: int
+) -> List[Tuple[int, Tuple[Op, object]]]:
+    '''(position, (operation, argument)) of the first n_tokens labels that are not $KEEP.
+
+    Words beyond the labels, e.g. truncated ones, are kept.
+    '''
+    if isinstance(labels, WordLabels):
+        table = compile_vocab(labels.id2label)
+        return [
+            (i, op) for i, op in enumerate(map(table.__getitem__, labels.ids[:n_tokens]))
+            if op is not None
+        ]
+    return [
+        (i, op) for i, op in enumerate(map(compile_label, labels[:n_tokens]))
+        if op[0] is not Op.KEEP
+    ]
+
 def process_token(
     token: str,
     label: str,
@@ -99,79 +138,494 @@ def get_word_masks_from_word_ids(
     word_ids: List[List[int]],
     n: int
 ):
-    word_masks = []
-    for i in range(n):
-        previous_id = 0
-        mask = []
-        for _id in word_ids(i):
-            if _id is None:
-                mask.append(0)
-            elif previous_id != _id:
-                mask.append(1)
+    all_word_ids = [word_ids(i) for i in range(n)]
+    lengths = [len(wids) for wids in all_word_ids]
+    word_masks = word_masks_from_word_ids(
+        word_ids_to_tensor(all_word_ids, max(lengths, default=0))
+    ).tolist()
+    return [mask[:length] for mask, length in zip(word_masks, lengths)]
+
+def make_token_budget_batches(
+    lengths: List[int],
+    max_batch_tokens: int
+) -> List[List[int]]:
+    '''Group indices sorted by length into batches of at most max_batch_tokens padded subwords.
+
+    Every batch is padded to its longest item, so the cost of a batch is
+        (the number of items) * (the longest length). An item that is longer
+        than the budget forms a batch on its own.
+    '''
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches = []
+    batch = []
+    for i in order:
+        # lengths[i] is the longest in the batch since the items are sorted.
+        if batch != [] and (len(batch) + 1) * lengths[i] > max_batch_tokens:
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch != []:
+        batches.append(batch)
+    return batches
+
+def _merge_windows(
+    srcs: List[List[str]],
+    windows: List[Tuple[int, int, int]],
+    window_labels: Dict[int, WordLabels],
+    pred_labels: List[WordLabels],
+    no_corrections: List[bool],
+    id2label: Dict[int, str],
+    no_correction_ids: List[int]
+) -> None:
+    # The labels of the k-th window are window_labels[len(srcs) + k].
+    by_sentence = {}
+    for k, (i, start, end) in enumerate(windows):
+        by_sentence.setdefault(i, []).append((len(srcs) + k, start, end))
+    for i, sentence_windows in by_sentence.items():
+        n_words = len(srcs[i])
+        with_scores = all(window_labels[w[0]].scores is not None for w in sentence_windows)
+        ids = []
+        scores = [] if with_scores else None
+        for position in range(n_words):
+            item, start, _ = max(
+                (w for w in sentence_windows if w[1] <= position < w[2]),
+                key=lambda w: window_centrality(position, w[1], w[2], n_words)
+            )
+            labels = window_labels[item]
+            if position - start < len(labels):
+                ids.append(labels.ids[position - start])
+                if with_scores:
+                    scores.append(labels.scores[position - start])
             else:
-                mask.append(0)
-            previous_id = _id
-        word_masks.append(mask)
-    return word_masks
+                # A word without subwords has no label, then it is kept.
+                ids.append(no_correction_ids[0])
+                if with_scores:
+                    scores.append((1.0, 0.0, [no_correction_ids[0]], [1.0]))
+        pred_labels[i] = WordLabels(ids, id2label, no_correction_ids, scores)
+        no_corrections[i] = all(id in no_correction_ids for id in ids)
+
+# The end of a pipeline queue.
+_DONE = object()
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    # False if the pipeline was stopped before there was room in q.
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.05)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+def _get(q: queue.Queue, stop: threading.Event):
+    # _DONE if the pipeline was stopped while q was empty.
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.05)
+        except queue.Empty:
+            pass
+    return _DONE
+
+def _run_pipeline(
+    batches: Iterable,
+    forward: Callable,
+    consume: Callable,
+    depth: int
+) -> Dict[str, float]:
+    '''Run forward() on every (key, inputs) of batches and consume(key, outputs) in order.
+
+    A helper thread takes the next batches from batches (i.e. collates them) and another
+        one consumes the outputs of the previous ones, while this thread runs forward().
+        The forward pass releases the GIL, so the Python work on both sides overlaps with it.
+        At most depth batches wait on either side of the forward pass.
+        An exception in any stage stops the others and is raised here.
+
+    Returns:
+        The busy seconds of each stage ("prepare", "forward", "consume"), the wall time
+            ("seconds") and "overlap", the seconds saved compared with running the stages
+            one after another.
+    '''
+    prepared = queue.Queue(maxsize=depth)
+    forwarded = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    errors = []
+    busy = {'prepare': 0.0, 'forward': 0.0, 'consume': 0.0}
+
+    def produce():
+        try:
+            iterator = iter(batches)
+            while True:
+                start = time.perf_counter()
+                item = next(iterator, _DONE)
+                busy['prepare'] += time.perf_counter() - start
+                if not _put(prepared, item, stop) or item is _DONE:
+                    return
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+
+    def consume_outputs():
+        try:
+            while True:
+                item = _get(forwarded, stop)
+                if item is _DONE:
+                    return
+                start = time.perf_counter()
+                consume(*item)
+                busy['consume'] += time.perf_counter() - start
+        except BaseException as e:
+            errors.append(e)
+            stop.set()
+
+    threads = [
+        threading.Thread(target=produce, name='gector-prepare', daemon=True),
+        threading.Thread(target=consume_outputs, name='gector-consume', daemon=True)
+    ]
+    start_time = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    try:
+        while True:
+            item = _get(prepared, stop)
+            if item is _DONE:
+                break
+            key, inputs = item
+            start = time.perf_counter()
+            outputs = forward(inputs)
+            busy['forward'] += time.perf_counter() - start
+            if not _put(forwarded, (key, outputs), stop):
+                break
+        _put(forwarded, _DONE, stop)
+        threads[1].join()
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    if errors != []:
+        raise errors[0]
+    seconds = time.perf_counter() - start_time
+    return dict(busy, seconds=seconds, overlap=max(0.0, sum(busy.values()) - seconds))
 
 def _predict(
     model: GECToR,
     tokenizer: PreTrainedTokenizer,
-    srcs: List[str],
+    srcs: List[List[str]],
     keep_confidence: float=0,
     min_error_prob: float=0,
-    batch_size: int=128
+    batch_size: int=128,
+    max_batch_tokens: Optional[int]=None,
+    top_k: int=0,
+    pipeline_depth: int=0
 ):
-    itr = list(range(0, len(srcs), batch_size))
-    pred_labels = []
-    no_corrections = []
+    '''Predict word-level labels of the sentences.
+
+    The sentences are sorted by the number of subwords and batched by
+        max_batch_tokens padded subwords, and each batch is padded only to
+        its longest sentence. The results are in the order of srcs.
+        If max_batch_tokens is None, batch_size * max_length is used,
+        i.e. the size of a batch of batch_size sentences padded to max_length.
+    A sentence longer than max_length subwords is split into overlapping windows
+        (see make_windows()), which are batched with the other sentences. The label
+        of a word is taken from the window where it is the farthest from the edges.
+    If top_k is positive, the labels also have the scores of each word, see WordLabels.score().
+    If pipeline_depth is positive, the batches are collated and their labels aligned on helper
+        threads while the model runs the other batches, with up to pipeline_depth batches
+        waiting, see _run_pipeline(). The labels are the same.
+    '''
+    if srcs == []:
+        return [], []
+    if max_batch_tokens is None:
+        max_batch_tokens = batch_size * model.config.max_length
+    pred_labels = [None] * len(srcs)
+    no_corrections = [None] * len(srcs)
     no_correction_ids = [model.config.label2id[l] for l in ['$KEEP', '<OOV>', '<PAD>']]
-    for i in itr:
-        # The official models was trained without special tokens, e.g. [CLS] [SEP].
-        batch = tokenizer(
-            srcs[i:i+batch_size],
-            return_tensors='pt',
+    # The official models was trained without special tokens, e.g. [CLS] [SEP].
+    add_special_tokens = not model.config.is_official_model
+    # Only the words that were not seen in the previous iterations are tokenized.
+    encoder = get_incremental_encoder(tokenizer)
+    with stage_timer('tokenize').time():
+        all_input_ids, all_word_ids = encoder.encode(
+            srcs,
             max_length=model.config.max_length,
-            padding='max_length',
-            truncation=True,
-            is_split_into_words=True,
-            add_special_tokens=not model.config.is_official_model
+            add_special_tokens=add_special_tokens
         )
-        batch['word_masks'] = torch.tensor(
-            get_word_masks_from_word_ids(
-                batch.word_ids,
-                batch['input_ids'].size(0)
+        # The sentence, the first word and the end of each window of the long sentences.
+        windows = []
+        max_subwords = model.config.max_length - encoder.n_special_tokens(add_special_tokens)
+        for i, input_ids in enumerate(all_input_ids):
+            if len(input_ids) < model.config.max_length:
+                continue
+            word_lengths = encoder.word_lengths(srcs[i])
+            if sum(word_lengths) <= max_subwords:
+                continue
+            for start, end in make_windows(word_lengths, max_subwords):
+                windows.append((i, start, end))
+        if windows != []:
+            window_input_ids, window_word_ids = encoder.encode(
+                [srcs[i][start:end] for i, start, end in windows],
+                max_length=model.config.max_length,
+                add_special_tokens=add_special_tokens
             )
-        )
-        word_ids = batch.word_ids
-        if torch.cuda.is_available():
-            batch = {k:v.cuda() for k,v in batch.items()}
-        outputs = model.predict(
-            batch['input_ids'],
-            batch['attention_mask'],
-            batch['word_masks'],
-            keep_confidence,
-            min_error_prob
-        )
+            all_input_ids += window_input_ids
+            all_word_ids += window_word_ids
+    # Inputs after len(srcs) are windows, the whole long sentences are not predicted.
+    windowed = set(i for i, _, _ in windows)
+    items = [i for i in range(len(srcs)) if i not in windowed] \
+        + list(range(len(srcs), len(all_input_ids)))
+    window_labels = {}
+    REGISTRY.counter(
+        'gector_windowed_sentences_total',
+        'Number of sentences longer than max_length split into windows'
+    ).inc(len(windowed))
+    lengths = [len(ids) for ids in all_input_ids]
+    subword_lengths = REGISTRY.histogram(
+        'gector_subword_length', 'Number of subwords per sentence or window',
+        buckets=LENGTH_BUCKETS
+    )
+    for item in items:
+        subword_lengths.observe(lengths[item])
+    id2label = model.config.id2label
+    predict_args = {
+        'keep_confidence': keep_confidence,
+        'min_error_prob': min_error_prob,
+        'return_labels': False,
+        'top_k': top_k
+    }
+
+    def prepare(batch_pos):
+        batch_idx = [items[k] for k in batch_pos]
+        max_len = max(lengths[i] for i in batch_idx)
+        with stage_timer('collate').time():
+            # Pad only to the longest sentence in the batch.
+            batch = encoder.build_batch(
+                [all_input_ids[i] for i in batch_idx],
+                [all_word_ids[i] for i in batch_idx]
+            )
+        REGISTRY.histogram(
+            'gector_batch_sentences', 'Number of sentences per forward batch',
+            buckets=BATCH_SIZE_BUCKETS
+        ).observe(len(batch_idx))
+        REGISTRY.histogram(
+            'gector_padding_ratio', 'Fraction of padding subwords per forward batch',
+            buckets=(0.05, 0.1, 0.2, 0.3, 0.5, 0.7, 0.9)
+        ).observe(1 - sum(lengths[i] for i in batch_idx) / (len(batch_idx) * max_len))
+        # The device of the model, which is the CPU for an exported graph.
+        batch = {k:v.to(model.device) for k,v in batch.items()}
+        # The label of a word is the label of its first subword.
+        first_index, word_valid = first_subword_index(batch['word_ids'])
+        inputs = {
+            'input_ids': batch['input_ids'],
+            'attention_mask': batch['attention_mask'],
+            'word_masks': batch['word_masks'],
+            'word_index': first_index
+        }
+        return (batch_idx, word_valid), inputs
+
+    def align(batch_idx, word_valid, outputs):
         # Align subword-level label to word-level label
-        for i in range(len(outputs.pred_labels)):
-            no_correct = True
-            labels = []
-            previous_word_idx = None
-            for j, idx in enumerate(word_ids(i)):
-                if idx is None:
+        with stage_timer('align').time():
+            label_ids = outputs.word_label_ids
+            is_correction = ~torch.isin(
+                label_ids,
+                torch.tensor(no_correction_ids, device=label_ids.device)
+            ) & word_valid
+            no_correct_flags = (~is_correction.any(dim=1)).tolist()
+            n_words = word_valid.sum(dim=1).tolist()
+            all_scores = None
+            if top_k > 0:
+                all_scores = list(zip(
+                    outputs.word_label_probability.tolist(),
+                    outputs.word_error_probability.tolist(),
+                    outputs.word_topk_ids.tolist(),
+                    outputs.word_topk_probability.tolist()
+                ))
+            for k, (i, ids) in enumerate(zip(batch_idx, label_ids.tolist())):
+                scores = None
+                if all_scores is not None:
+                    scores = list(zip(*(values[:n_words[k]] for values in all_scores[k])))
+                # The strings are looked up only when the labels are used.
+                labels = WordLabels(ids[:n_words[k]], id2label, no_correction_ids, scores)
+                if i >= len(srcs):
+                    window_labels[i] = labels
                     continue
-                if idx != previous_word_idx:
-                    labels.append(outputs.pred_labels[i][j])
-                    if outputs.pred_label_ids[i][j] not in no_correction_ids:
-                        no_correct = False
-                previous_word_idx = idx
-            # print(no_correct, labels)
-            pred_labels.append(labels)
-            no_corrections.append(no_correct)
+                pred_labels[i] = labels
+                no_corrections[i] = no_correct_flags[k]
+
+    batch_positions = make_token_budget_batches([lengths[item] for item in items], max_batch_tokens)
+    batches = (prepare(batch_pos) for batch_pos in batch_positions)
+    if hasattr(model, 'predict_batches'):
+        # A ReplicaPool runs the forward passes of several batches at once, in other processes.
+        for (batch_idx, word_valid), outputs in model.predict_batches(batches, **predict_args):
+            align(batch_idx, word_valid, outputs)
+    elif pipeline_depth > 0 and len(batch_positions) > 1:
+        # A single batch has nothing to overlap with.
+        def forward(inputs):
+            with stage_timer('forward').time():
+                return model.predict(**inputs, **predict_args)
+        stats = _run_pipeline(
+            batches,
+            forward,
+            lambda key, outputs: align(*key, outputs),
+            pipeline_depth
+        )
+        REGISTRY.counter(
+            'gector_pipeline_overlap_seconds_total',
+            'Seconds of collation and alignment overlapped with the forward passes'
+        ).inc(stats['overlap'])
+    else:
+        for (batch_idx, word_valid), inputs in batches:
+            with stage_timer('forward').time():
+                outputs = model.predict(**inputs, **predict_args)
+            align(batch_idx, word_valid, outputs)
+    with stage_timer('align').time():
+        _merge_windows(srcs, windows, window_labels, pred_labels, no_corrections,
+                       id2label, no_correction_ids)
     # print(pred_labels)
     return pred_labels, no_corrections
 
+@dataclass
+class _Sentence:
+    words: List[str]  # The words of the source sentence.
+    tokens: List[str]  # $START and the words after the iterations so far.
+    callback: Callable[[Any], None]
+    n_iteration: int = 0
+    # The provenance of the tokens for return_edits, None once it is lost.
+    tracked: Optional[List[TrackedToken]] = None
+    removed: List[TrackedToken] = field(default_factory=list)
+
+class IterativeScheduler:
+    '''Continuous batching of the correction iterations.
+
+    Instead of running iteration k for all the remaining sentences, every step()
+        forms a working batch of batch_size sentences: first the sentences that
+        need another iteration, then new ones added by add(). A sentence that is
+        finished (no more edits, or n_iteration reached) frees its slot at once,
+        so the batches stay full while there is work, also when new sentences
+        keep arriving, e.g. in the API server.
+
+    The other arguments are the same as predict(). Not thread-safe.
+    '''
+    def __init__(
+        self,
+        model: GECToR,
+        tokenizer: PreTrainedTokenizer,
+        encode: dict,
+        decode: dict,
+        keep_confidence: float=0,
+        min_error_prob: float=0,
+        batch_size: int=128,
+        n_iteration: int=5,
+        max_batch_tokens: Optional[int]=None,
+        return_edits: bool=False,
+        top_k: int=0,
+        pipeline_depth: int=0
+    ):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.encode = encode
+        self.decode = decode
+        self.keep_confidence = keep_confidence
+        self.min_error_prob = min_error_prob
+        self.batch_size = batch_size
+        self.n_iteration = n_iteration
+        self.max_batch_tokens = max_batch_tokens
+        self.return_edits = return_edits
+        # The scores are only used by the edits.
+        self.top_k = top_k if return_edits else 0
+        self.pipeline_depth = pipeline_depth
+        self._continuations = deque()
+        self._fresh = deque()
+        self._n_iterations = REGISTRY.histogram(
+            'gector_iterations_per_sentence', 'Number of forward passes until a sentence is finished',
+            buckets=tuple(range(1, n_iteration + 1))
+        )
+
+    def add(self, src: str, callback: Callable[[Any], None]) -> None:
+        '''Queue a sentence. callback(result) is called from step() when it is finished.'''
+        words = src.split(' ')
+        self._fresh.append(_Sentence(
+            words,
+            ['$START'] + words,
+            callback,
+            tracked=track_src(words) if self.return_edits else None
+        ))
+
+    def __len__(self) -> int:
+        '''The number of sentences that are not finished.'''
+        return len(self._continuations) + len(self._fresh)
+
+    def _finish(self, sent: _Sentence) -> None:
+        corrected = ' '.join(sent.tokens).replace('$START ', '')
+        if self.return_edits:
+            edits = None
+            if sent.tracked is not None:
+                edits = extract_edits(sent.words, sent.tracked, sent.removed)
+            if edits is None:
+                edits = diff_edits(sent.words, corrected.split(' '))
+            corrected = (corrected, edits)
+        sent.callback(corrected)
+
+    def step(self) -> int:
+        '''Run one forward pass over a working batch. Returns the number of sentences in it.'''
+        batch = []
+        while len(batch) < self.batch_size and (self._continuations or self._fresh):
+            pending = self._continuations if self._continuations else self._fresh
+            batch.append(pending.popleft())
+        if batch == []:
+            return 0
+        REGISTRY.histogram(
+            'gector_working_batch_sentences', 'Number of sentences per scheduler step',
+            buckets=BATCH_SIZE_BUCKETS
+        ).observe(len(batch))
+        pred_labels, no_corrections = _predict(
+            self.model,
+            self.tokenizer,
+            [sent.tokens for sent in batch],
+            self.keep_confidence,
+            self.min_error_prob,
+            self.batch_size,
+            self.max_batch_tokens,
+            top_k=self.top_k,
+            pipeline_depth=self.pipeline_depth
+        )
+        to_edit = []
+        for sent, labels, no_correct in zip(batch, pred_labels, no_corrections):
+            sent.n_iteration += 1
+            if no_correct: # there's no corrections?
+                self._n_iterations.observe(sent.n_iteration)
+                self._finish(sent)
+            else:
+                to_edit.append((sent, labels))
+        if to_edit == []:
+            return len(batch)
+        with stage_timer('edit').time():
+            edited_srcs = edit_src_by_tags(
+                [sent.tokens for sent, _ in to_edit],
+                [labels for _, labels in to_edit],
+                self.encode,
+                self.decode
+            )
+            if self.return_edits:
+                for (sent, labels), edited in zip(to_edit, edited_srcs):
+                    if sent.tracked is not None:
+                        sent.tracked, removed_tokens = edit_tracked_tokens_by_tags(
+                            sent.tracked,
+                            _compile_ops(labels, len(sent.tracked)),
+                            labels,
+                            edited,
+                            self.decode,
+                            score=labels.score if self.top_k > 0 else None
+                        )
+                        sent.removed += removed_tokens
+        for (sent, _), edited in zip(to_edit, edited_srcs):
+            sent.tokens = edited
+            if sent.n_iteration >= self.n_iteration:
+                self._n_iterations.observe(self.n_iteration)
+                self._finish(sent)
+            else:
+                self._continuations.append(sent)
+        return len(batch)
+
 def predict(
     model: GECToR,
     tokenizer: PreTrainedTokenizer,
@@ -181,44 +635,55 @@ def predict(
     keep_confidence: float=0,
     min_error_prob: float=0,
     batch_size: int=128,
-    n_iteration: int=5
-) -> List[str]:
-    srcs = [['$START'] + src.split(' ') for src in srcs]
+    n_iteration: int=5,
+    callback: Optional[Callable[[int, Any], None]]=None,
+    return_edits: bool=False,
+    max_batch_tokens: Optional[int]=None,
+    top_k: int=0,
+    pipeline_depth: int=0
+) -> List[Any]:
+    '''Correct sentences by iteratively applying the predicted tags.
+
+    If callback is given, callback(index, corrected_sentence) is called as soon as
+        the correction of each sentence is finished, i.e. the model predicts no more
+        edits for it or it reached n_iteration.
+    If return_edits is True, the tokens are tracked through the iterations and
+        a (corrected_sentence, edits) tuple is returned for each sentence instead,
+        where edits are the word-level edits of gector.edits.extract_edits().
+        With top_k > 0, every edit also has the scores of its tags: the tag and the error
+        probabilities and the top_k alternative tags, taken from the same forward pass.
+    The iterations are scheduled by IterativeScheduler, so every forward pass runs
+        batch_size sentences (until the work runs out), split into batches of
+        max_batch_tokens padded subwords, see _predict(). With pipeline_depth > 0, these
+        batches are collated and aligned on helper threads during the forward passes.
+    '''
     final_edited_sents = ['-1'] * len(srcs)
-    to_be_processed = srcs
-    original_sent_idx = list(range(0, len(srcs)))
-    for itr in range(n_iteration):
-        print(f'Iteratoin {itr}. the number of to_be_processed: {len(to_be_processed)}')
-        pred_labels, no_corrections = _predict(
-            model,
-            tokenizer,
-            to_be_processed,
-            keep_confidence,
-            min_error_prob,
-            batch_size
-        )
-        current_srcs = []
-        current_pred_labels = []
-        current_orig_idx = []
-        for i, yes in enumerate(no_corrections):
-            if yes: # there's no corrections?
-                final_edited_sents[original_sent_idx[i]] = ' '.join(to_be_processed[i]).replace('$START ', '')
-            else:
-                current_srcs.append(to_be_processed[i])
-                current_pred_labels.append(pred_labels[i])
-                current_orig_idx.append(original_sent_idx[i])
-        if current_srcs == []:
-            # Correcting for all sentences is completed.
-            break
-        edited_srcs = edit_src_by_tags(
-            current_srcs,
-            current_pred_labels,
-            encode,
-            decode
-        )
-        to_be_processed = edited_srcs
-        original_sent_idx = current_orig_idx
-    for i in range(len(to_be_processed)):
-        final_edited_sents[original_sent_idx[i]] = ' '.join(to_be_processed[i]).replace('$START ', '')
+    def finalize(idx: int, result: Any):
+        final_edited_sents[idx] = result
+        if callback is not None:
+            callback(idx, result)
+
+    scheduler = IterativeScheduler(
+        model,
+        tokenizer,
+        encode,
+        decode,
+        keep_confidence=keep_confidence,
+        min_error_prob=min_error_prob,
+        batch_size=batch_size,
+        n_iteration=n_iteration,
+        max_batch_tokens=max_batch_tokens,
+        return_edits=return_edits,
+        top_k=top_k,
+        pipeline_depth=pipeline_depth
+    )
+    # Sentences of similar length are started together, so that they share forward batches.
+    for idx in sorted(range(len(srcs)), key=lambda i: len(srcs[i].split(' '))):
+        scheduler.add(srcs[idx], functools.partial(finalize, idx))
+    step = 0
+    while len(scheduler) > 0:
+        logger.debug('Step %d. the number of to_be_processed: %d', step, len(scheduler))
+        scheduler.step()
+        step += 1
     assert('-1' not in final_edited_sents)
-    return final_edited_sents
\ No newline at end of file
+    return final_edited_sents
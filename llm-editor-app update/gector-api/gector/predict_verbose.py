@@ -3,7 +3,7 @@ import os
 from tqdm import tqdm
 from .modeling import GECToR
 from transformers import PreTrainedTokenizer
-from typing import List, Dict
+from typing import List, Dict, Optional
 from .predict import (
     edit_src_by_tags,
     _predict
@@ -18,7 +18,8 @@ def predict_verbose(
     keep_confidence: float=0,
     min_error_prob: float=0,
     batch_size: int=128,
-    n_iteration: int=5
+    n_iteration: int=5,
+    max_batch_tokens: Optional[int]=None
 ) -> List[str]:
     srcs = [['$START'] + src.split(' ') for src in srcs]
     final_edited_sents = ['-1'] * len(srcs)
@@ -40,7 +41,8 @@ def predict_verbose(
             to_be_processed,
             keep_confidence,
             min_error_prob,
-            batch_size
+            batch_size,
+            max_batch_tokens
         )
         current_srcs = []
         current_pred_labels = []
@@ -64,7 +66,7 @@ def predict_verbose(
         # Register the information during iteration.
         # edited_src will be the src of the next iteration.
         for i, orig_id in enumerate(current_orig_idx):
-            iteration_log[orig_id][itr]['tag'] = current_pred_labels[i]
+            iteration_log[orig_id][itr]['tag'] = list(current_pred_labels[i])
             iteration_log[orig_id].append({
                 'src': edited_srcs[i],
                 'tag': None
@@ -0,0 +1,302 @@
+import dataclasses
+import itertools
+import os
+import queue
+import threading
+import time
+import torch
+import torch.multiprocessing as mp
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from .metrics import REGISTRY
+from .modeling import GECToR, GECToRPredictionOutput
+
+def _available_cores() -> List[int]:
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def split_cores(n_replicas: int, cores: Optional[List[int]]=None) -> List[List[int]]:
+    '''Split the cores into n_replicas contiguous groups, whose sizes differ by at most one.
+
+    Raises:
+        ValueError: If there are fewer cores than replicas.
+    '''
+    if cores is None:
+        cores = _available_cores()
+    if not 0 < n_replicas <= len(cores):
+        raise ValueError(f'{n_replicas} replicas can not be pinned to {len(cores)} cores.')
+    size, extra = divmod(len(cores), n_replicas)
+    groups = []
+    start = 0
+    for i in range(n_replicas):
+        end = start + size + (i < extra)
+        groups.append(cores[start:end])
+        start = end
+    return groups
+
+def _replica_main(
+    index: int,
+    model: GECToR,
+    cores: List[int],
+    requests: mp.Queue,
+    results: mp.Queue
+) -> None:
+    # Runs in the process of a replica until it gets None.
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+    while True:
+        request = requests.get()
+        if request is None:
+            return
+        task_id, inputs, predict_args = request
+        start = time.perf_counter()
+        try:
+            with torch.no_grad():
+                outputs = model.predict(
+                    **{k: torch.from_numpy(v) for k, v in inputs.items()},
+                    **predict_args
+                )
+            # Only the tensors that are set, as numpy arrays, which are pickled by value.
+            payload = {
+                field.name: getattr(outputs, field.name).numpy()
+                for field in dataclasses.fields(outputs)
+                if isinstance(getattr(outputs, field.name), torch.Tensor)
+            }
+            results.put((task_id, index, time.perf_counter() - start, payload, None))
+        except Exception as e:
+            results.put((task_id, index, time.perf_counter() - start, None, e))
+
+class ReplicaPool:
+    '''Data-parallel CPU inference with replicas of a GECToR in separate processes.
+
+    Every replica is pinned to its own group of cores (see split_cores()) and uses as many
+        intra-op threads as it has cores. The weights are moved to shared memory once and
+        mapped by all the replicas, which only read them. A batch goes to the replica with
+        the fewest batches in progress.
+
+    It can be passed to predict() in place of the model: _predict() dispatches the batches
+        of an iteration by predict_batches(), which keeps every replica busy and returns the
+        outputs in order. It is thread-safe, so several inference threads can share it.
+        The processes are started on first use in each process, e.g. after a fork of the
+        API workers, and stopped by close().
+
+    Args:
+        model (GECToR): The model on CPU.
+        n_replicas (int): The number of processes.
+        cores (List[int]): The cores to split between the replicas. If None, those this
+            process may run on.
+    '''
+    def __init__(
+        self,
+        model: GECToR,
+        n_replicas: int,
+        cores: Optional[List[int]]=None
+    ):
+        self.model = model.cpu().eval()
+        self.config = model.config
+        self.device = torch.device('cpu')
+        self.cores = split_cores(n_replicas, cores)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._processes = []
+        self._requests = []
+        self._results = None
+        self._futures: Dict[int, Tuple[int, Future]] = {}
+        self._task_ids = itertools.count()
+        self._in_progress = [0] * n_replicas
+        self._busy = [0.0] * n_replicas
+        self._n_batches = [0] * n_replicas
+        self._start_time = None
+
+    def __len__(self) -> int:
+        return len(self.cores)
+
+    def eval(self) -> 'ReplicaPool':
+        return self
+
+    def _start(self) -> None:
+        # Called with the lock.
+        if self._pid == os.getpid():
+            return
+        # fork is unsafe once torch has started its thread pools.
+        ctx = mp.get_context('spawn')
+        self.model.share_memory()
+        self._results = ctx.Queue()
+        self._requests = []
+        self._processes = []
+        for i, cores in enumerate(self.cores):
+            requests = ctx.Queue()
+            process = ctx.Process(
+                target=_replica_main,
+                args=(i, self.model, cores, requests, self._results),
+                name=f'gector-replica-{i}',
+                daemon=True
+            )
+            process.start()
+            self._requests.append(requests)
+            self._processes.append(process)
+        self._futures = {}
+        self._in_progress = [0] * len(self.cores)
+        self._busy = [0.0] * len(self.cores)
+        self._n_batches = [0] * len(self.cores)
+        self._start_time = time.perf_counter()
+        self._pid = os.getpid()
+        threading.Thread(
+            target=self._collect, args=(self._results,), name='gector-replica-results', daemon=True
+        ).start()
+
+    def _collect(self, results: mp.Queue) -> None:
+        while True:
+            try:
+                task_id, index, seconds, payload, error = results.get(timeout=1)
+            except queue.Empty:
+                self._fail_dead_replicas()
+                continue
+            except (EOFError, OSError, ValueError):
+                # The queue was closed by close().
+                return
+            if task_id is None:
+                return
+            with self._lock:
+                task = self._futures.pop(task_id, None)
+                self._in_progress[index] -= 1
+                self._busy[index] += seconds
+                self._n_batches[index] += 1
+            REGISTRY.counter(
+                'gector_replica_busy_seconds_total', 'Seconds each replica spent on forward passes',
+                replica=str(index)
+            ).inc(seconds)
+            if task is None:
+                # Already failed by _fail_dead_replicas().
+                continue
+            _, future = task
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(GECToRPredictionOutput(
+                    **{k: torch.from_numpy(v) for k, v in payload.items()}
+                ))
+
+    def _fail_dead_replicas(self) -> None:
+        with self._lock:
+            dead = [i for i, p in enumerate(self._processes) if not p.is_alive()]
+            failed = [
+                (task_id, future) for task_id, (index, future) in self._futures.items()
+                if index in dead
+            ]
+            for task_id, _ in failed:
+                del self._futures[task_id]
+        for _, future in failed:
+            future.set_exception(RuntimeError('The replica process died.'))
+
+    def submit(self, inputs: Dict[str, torch.Tensor], **predict_args) -> Future:
+        '''Run GECToR.predict() on a batch in a replica.
+
+        Args:
+            inputs: input_ids, attention_mask, word_masks and word_index of GECToR.predict().
+            predict_args: The other arguments of GECToR.predict().
+
+        Returns:
+            A Future of the GECToRPredictionOutput, with the tensors that are not None.
+        '''
+        future = Future()
+        arrays = {k: v.cpu().numpy() for k, v in inputs.items() if v is not None}
+        with self._lock:
+            self._start()
+            index = min(range(len(self.cores)), key=lambda i: (self._in_progress[i], self._n_batches[i]))
+            task_id = next(self._task_ids)
+            self._futures[task_id] = (index, future)
+            self._in_progress[index] += 1
+            self._requests[index].put((task_id, arrays, predict_args))
+        return future
+
+    def predict_batches(
+        self,
+        batches: Iterable[Tuple[Any, Dict[str, torch.Tensor]]],
+        **predict_args
+    ) -> Iterator[Tuple[Any, GECToRPredictionOutput]]:
+        '''Run GECToR.predict() on (key, inputs) batches and yield (key, outputs) in order.
+
+        Up to two batches per replica are in progress at a time, so the batches can be
+            produced lazily, e.g. collated while the replicas run.
+        '''
+        pending = deque()
+        max_pending = 2 * len(self.cores)
+        for key, inputs in batches:
+            pending.append((key, self.submit(inputs, **predict_args)))
+            if len(pending) >= max_pending:
+                key, future = pending.popleft()
+                yield key, future.result()
+        while pending:
+            key, future = pending.popleft()
+            yield key, future.result()
+
+    def predict(
+        self,
+        input_ids: torch.Tensor,
+        attention_mask: torch.Tensor,
+        word_masks: torch.Tensor,
+        keep_confidence: float=0,
+        min_error_prob: float=0,
+        word_index: Optional[torch.Tensor]=None,
+        return_labels: bool=True,
+        top_k: int=0
+    ) -> GECToRPredictionOutput:
+        '''The same as GECToR.predict(), on one of the replicas. pred_labels is not returned.'''
+        inputs = {
+            'input_ids': input_ids,
+            'attention_mask': attention_mask,
+            'word_masks': word_masks,
+            'word_index': word_index
+        }
+        return self.submit(
+            inputs,
+            keep_confidence=keep_confidence,
+            min_error_prob=min_error_prob,
+            return_labels=False,
+            top_k=top_k
+        ).result()
+
+    def stats(self) -> List[Dict[str, Any]]:
+        '''The cores, the number of batches, the busy seconds and the utilization of each replica.
+
+        The utilization is the fraction of the time since the replicas were started
+            that a replica spent on forward passes.
+        '''
+        with self._lock:
+            if self._start_time is None:
+                return []
+            elapsed = time.perf_counter() - self._start_time
+            stats = [
+                {
+                    'replica': i,
+                    'cores': cores,
+                    'batches': self._n_batches[i],
+                    'busy_seconds': self._busy[i],
+                    'utilization': self._busy[i] / elapsed if elapsed > 0 else 0.0
+                }
+                for i, cores in enumerate(self.cores)
+            ]
+        for s in stats:
+            REGISTRY.gauge(
+                'gector_replica_utilization', 'Fraction of the time each replica spent on forward passes',
+                replica=str(s['replica'])
+            ).set(s['utilization'])
+        return stats
+
+    def close(self) -> None:
+        '''Stop the processes after the batches in progress.'''
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            for requests in self._requests:
+                requests.put(None)
+            processes = self._processes
+            self._pid = None
+        for process in processes:
+            process.join()
+        # Stop the collector thread.
+        self._results.put((None, None, None, None, None))
@@ -0,0 +1,165 @@
+import re
+from typing import Dict, List, Optional, Tuple
+
+# A sentence ends with [.!?] (optionally followed by closing quotes or brackets)
+#   that is followed by whitespace, or with a line break.
+SENTENCE_BOUNDARY = re.compile(r'[.!?]+[\'")\]]*(?=\s)|\n')
+ABBREVIATIONS = {
+    'mr', 'mrs', 'ms', 'dr', 'prof', 'sr', 'jr', 'st',
+    'vs', 'etc', 'e.g', 'i.e', 'no', 'fig', 'approx'
+}
+
+# Words (with inner hyphens), numbers, the parts of English contractions and any other
+#   single character, roughly the tokenization of the corpora GECToR was trained on,
+#   e.g. "Don't stop, it's 3.5km-long." -> Do n't stop , it 's 3.5 km-long .
+WORD = re.compile(r'''
+    \w+(?=n['’]t\b)
+  | n['’]t\b
+  | ['’](?:s|re|ve|ll|d|m)\b
+  | \d+(?:[.,]\d+)+
+  | \w+(?:-\w+)*
+  | \S
+''', re.X | re.I)
+CONTRACTION = re.compile(r"n['’]t|['’](?:s|re|ve|ll|d|m)", re.I)
+# Tokens that are written without a space before or after them.
+NO_SPACE_BEFORE = set('.,!?;:%)]}…')
+NO_SPACE_AFTER = set('([{$')
+
+def _is_abbreviation(text: str, dot_pos: int) -> bool:
+    if text[dot_pos] != '.':
+        return False
+    start = dot_pos
+    while start > 0 and not text[start - 1].isspace():
+        start -= 1
+    word = text[start:dot_pos].lower()
+    # A single letter is an initial, e.g. "J. K. Rowling".
+    return word in ABBREVIATIONS or (len(word) == 1 and word.isalpha())
+
+def _strip_span(text: str, start: int, end: int) -> Tuple[int, int]:
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+def split_sentences(text: str) -> List[Tuple[int, int]]:
+    '''Split a text into sentences.
+
+    Args:
+        text (str): A raw text, e.g. a whole document.
+
+    Returns:
+        List[Tuple[int, int]]: Character spans (start, end) of the sentences.
+            Leading and trailing whitespace is not included, and
+            empty sentences are skipped.
+    '''
+    spans = []
+    start = 0
+    for m in SENTENCE_BOUNDARY.finditer(text):
+        if _is_abbreviation(text, m.start()):
+            continue
+        span = _strip_span(text, start, m.end())
+        if span[0] < span[1]:
+            spans.append(span)
+        start = m.end()
+    span = _strip_span(text, start, len(text))
+    if span[0] < span[1]:
+        spans.append(span)
+    return spans
+
+def tokenize_words(text: str, start: int=0, end: Optional[int]=None) -> List[Tuple[int, int]]:
+    '''Split text[start:end] into words, see WORD.
+
+    Returns:
+        List[Tuple[int, int]]: Character spans (start, end) of the words in text,
+            so that ' '.join(text[s:e] for s, e in spans) is the input of the model and
+            the words can be mapped back to the original text.
+    '''
+    return [m.span() for m in WORD.finditer(text, start, len(text) if end is None else end)]
+
+def space_between(left: str, right: str) -> str:
+    '''The separator of two adjacent tokens in detokenized text, " " or "".'''
+    if right[:1] in NO_SPACE_BEFORE or CONTRACTION.fullmatch(right) or left[-1:] in NO_SPACE_AFTER:
+        return ''
+    return ' '
+
+def detokenize(tokens: List[str]) -> str:
+    '''Join tokens with spaces except before punctuation and contractions, the inverse of tokenize_words().'''
+    if tokens == []:
+        return ''
+    parts = [tokens[0]]
+    for left, right in zip(tokens, tokens[1:]):
+        parts.append(space_between(left, right))
+        parts.append(right)
+    return ''.join(parts)
+
+def project_edits(
+    text: str,
+    spans: List[Tuple[int, int]],
+    edits: List[Dict]
+) -> List[Optional[Tuple[int, int, str]]]:
+    '''Map word-level edits (see gector.edits.extract_edits()) to the original text.
+
+    Args:
+        text (str): The original text.
+        spans (List[Tuple[int, int]]): The spans of the words of tokenize_words().
+        edits (List[Dict]): Edits of the words, by their indices in spans.
+
+    Returns:
+        List[Optional[Tuple[int, int, str]]]: (start, end, replacement) in text for each edit,
+            in order, or None for an edit that can not be projected: one beyond the words,
+            or an insertion of nothing. The whitespace between the words is kept, the edited
+            words are detokenized, and insertions and deletions include their separating space.
+    '''
+    words = [text[s:e] for s, e in spans]
+    replacements = []
+    for edit in edits:
+        start, end = edit['start'], edit['end']
+        corrected = edit['corrected'].split(' ') if edit['corrected'] != '' else []
+        if end > len(spans) or (edit['type'] == 'insert' and corrected == []):
+            replacements.append(None)
+        elif edit['type'] == 'insert':
+            if start > 0:
+                # After the previous word.
+                pos = spans[start-1][1]
+                replacement = space_between(words[start-1], corrected[0]) + detokenize(corrected)
+            else:
+                pos = spans[0][0] if spans else 0
+                replacement = detokenize(corrected)
+                if spans:
+                    replacement += space_between(corrected[-1], words[0])
+            replacements.append((pos, pos, replacement))
+        elif edit['type'] == 'delete' or corrected == []:
+            if start > 0 and end < len(spans):
+                # The neighbours are joined by the whitespace before or after the deleted words.
+                gap = ''
+                if space_between(words[start-1], words[end]) != '':
+                    gap = text[spans[start-1][1]:spans[start][0]] \
+                        or text[spans[end-1][1]:spans[end][0]] or ' '
+                replacements.append((spans[start-1][1], spans[end][0], gap))
+            elif start > 0:
+                replacements.append((spans[start-1][1], spans[end-1][1], ''))
+            elif end < len(spans):
+                replacements.append((spans[start][0], spans[end][0], ''))
+            else:
+                replacements.append((spans[start][0], spans[end-1][1], ''))
+        else:
+            replacements.append((spans[start][0], spans[end-1][1], detokenize(corrected)))
+    return replacements
+
+def apply_replacements(
+    text: str,
+    replacements: List[Tuple[int, int, str]],
+    start: int=0,
+    end: Optional[int]=None
+) -> str:
+    '''Apply non-overlapping (start, end, replacement) of project_edits() to text[start:end].'''
+    end = len(text) if end is None else end
+    parts = []
+    last = start
+    for s, e, replacement in sorted(replacements, key=lambda r: (r[0], r[1])):
+        parts.append(text[last:s])
+        parts.append(replacement)
+        last = e
+    parts.append(text[last:end])
+    return ''.join(parts)
@@ -0,0 +1,213 @@
+import json
+import multiprocessing
+import os
+import torch
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, Iterator, List, Optional, Tuple
+from .predict import predict
+
+# The model, the tokenizer and the arguments of predict() of this process, set by _init_worker().
+_worker = {}
+
+def _init_worker(
+    load_model: Callable,
+    predict_args: dict,
+    num_threads: Optional[int]=None
+) -> None:
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    model, tokenizer = load_model()
+    _worker.update(model=model, tokenizer=tokenizer, predict_args=predict_args)
+
+def _correct(lines: List[str]) -> List[str]:
+    return predict(
+        _worker['model'],
+        _worker['tokenizer'],
+        lines,
+        **_worker['predict_args']
+    )
+
+def _read_lines(f) -> Iterator[Tuple[str, int]]:
+    # The lines of a binary file like those of open() in text mode, i.e. with universal
+    #   newlines, and the byte offset after each of them.
+    start = f.tell()
+    for line in f:
+        end = f.tell()
+        if line.endswith(b'\n'):
+            line = line[:-1]
+        if line.endswith(b'\r'):
+            line = line[:-1]
+        parts = line.split(b'\r')
+        for part in parts[:-1]:
+            # A lone \r also ends a line.
+            start += len(part) + 1
+            yield part.decode('utf-8'), start
+        yield parts[-1].decode('utf-8'), end
+        start = end
+
+def read_chunks(
+    path: str,
+    chunk_size: int,
+    offset: int=0
+) -> Iterator[Tuple[List[str], int]]:
+    '''Read the sentences of a file, one per line, in chunks of chunk_size lines.
+
+    The lines are the same as those of open(path).read().rstrip().split('\n'):
+        the whitespace at the end of the file, including blank lines, is dropped.
+
+    Args:
+        offset (int): The byte offset to start reading from, e.g. from a checkpoint.
+
+    Yields:
+        The lines without newlines, and the byte offset after the last of them.
+    '''
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        lines = []
+        last_offset = offset
+        n_read = 0
+        # The last line that is not blank and the blank ones after it, which are held back
+        #   until a line that is not blank shows that they do not end the file.
+        tail = []
+        for line, line_offset in _read_lines(f):
+            if line.strip() != '':
+                for held, last_offset in tail:
+                    lines.append(held)
+                    if len(lines) == chunk_size:
+                        yield lines, last_offset
+                        n_read += len(lines)
+                        lines = []
+                tail = []
+            tail.append((line, line_offset))
+        if tail != [] and tail[0][0].strip() != '':
+            lines.append(tail[0][0].rstrip())
+            last_offset = tail[0][1]
+        elif n_read == 0 and lines == [] and offset == 0:
+            # Like ''.split('\n'), an empty file is one empty sentence.
+            lines.append('')
+            last_offset = f.tell()
+        if lines != []:
+            yield lines, last_offset
+
+def load_checkpoint(path: str, input_path: str) -> dict:
+    '''The state of stream_predict() saved in path, or the initial state if it does not exist.
+
+    Raises:
+        ValueError: If the checkpoint was saved for another input.
+    '''
+    state = {'input': os.path.abspath(input_path), 'input_offset': 0, 'output_offset': 0, 'n_lines': 0}
+    if not os.path.exists(path):
+        return state
+    with open(path) as f:
+        saved = json.load(f)
+    if saved['input'] != state['input']:
+        raise ValueError(f'{path} is a checkpoint of {saved["input"]}, not {state["input"]}.')
+    return saved
+
+def save_checkpoint(path: str, state: dict) -> None:
+    # Replaced atomically, so that a crash leaves either the old or the new checkpoint.
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def stream_predict(
+    input_path: str,
+    output_path: str,
+    load_model: Callable,
+    predict_args: dict,
+    chunk_size: int=10000,
+    n_workers: int=1,
+    checkpoint_path: Optional[str]=None
+) -> int:
+    '''Correct a file of sentences, one per line, in chunks with bounded memory.
+
+    The corrected chunks are appended to output_path in the input order, and after each
+        of them the input and output offsets are saved to checkpoint_path.
+        If the checkpoint exists, the output is truncated to its offset and the prediction
+        resumes from there, so the output is the same as that of an uninterrupted run.
+        The checkpoint is removed when the whole input is corrected.
+
+    Args:
+        load_model (Callable): Returns (model, tokenizer). It is called once per worker,
+            so with n_workers > 1 it must be picklable, e.g. a functools.partial of a
+            module-level function.
+        predict_args (dict): The arguments of predict() other than model, tokenizer and srcs.
+        n_workers (int): The number of processes that correct the chunks. Each loads its own
+            model and uses cpu_count / n_workers intra-op threads. With 1, the chunks are
+            corrected in this process.
+        checkpoint_path (str): The default is output_path + ".ckpt".
+
+    Returns:
+        The number of lines corrected in this call.
+
+    Raises:
+        ValueError: If the checkpoint is of another input, or the output it was saved for
+            is missing or shorter.
+    '''
+    if checkpoint_path is None:
+        checkpoint_path = output_path + '.ckpt'
+    state = load_checkpoint(checkpoint_path, input_path)
+    if state['n_lines'] > 0 and (
+        not os.path.exists(output_path) or os.path.getsize(output_path) < state['output_offset']
+    ):
+        raise ValueError(
+            f'{output_path} is missing or shorter than saved in {checkpoint_path}. '
+            'Remove the checkpoint to start again.'
+        )
+    executor = None
+    if n_workers > 1:
+        executor = ProcessPoolExecutor(
+            max_workers=n_workers,
+            # fork is unsafe once torch has started its thread pools.
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(load_model, predict_args, max(1, (os.cpu_count() or 1) // n_workers))
+        )
+    else:
+        _init_worker(load_model, predict_args)
+    # At most 2 chunks per worker are read ahead of the one being written.
+    max_pending = 2 * n_workers if executor is not None else 1
+    pending = deque()
+    n_lines = 0
+    mode = 'r+b' if state['n_lines'] > 0 else 'wb'
+    try:
+        with open(output_path, mode) as out:
+            # Drop what was written after the last checkpoint.
+            out.truncate(state['output_offset'])
+            out.seek(state['output_offset'])
+            def write_next():
+                future, lines_in_chunk, input_offset = pending.popleft()
+                corrected = '\n'.join(future.result())
+                if state['n_lines'] > 0:
+                    corrected = '\n' + corrected
+                out.write(corrected.encode('utf-8'))
+                out.flush()
+                os.fsync(out.fileno())
+                state['output_offset'] = out.tell()
+                state['input_offset'] = input_offset
+                state['n_lines'] += lines_in_chunk
+                save_checkpoint(checkpoint_path, state)
+                return lines_in_chunk
+            for lines, input_offset in read_chunks(input_path, chunk_size, state['input_offset']):
+                if executor is not None:
+                    future = executor.submit(_correct, lines)
+                else:
+                    future = Future()
+                    future.set_result(_correct(lines))
+                pending.append((future, len(lines), input_offset))
+                if len(pending) >= max_pending:
+                    n_lines += write_next()
+            while pending:
+                n_lines += write_next()
+    finally:
+        if executor is not None:
+            for future, _, _ in pending:
+                future.cancel()
+            executor.shutdown()
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    return n_lines
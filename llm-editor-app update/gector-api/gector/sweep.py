@@ -0,0 +1,176 @@
+import copy
+import threading
+import torch
+import torch.nn.functional as F
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from transformers import PreTrainedTokenizer
+from .modeling import GECToR, GECToRPredictionOutput
+from .predict import predict
+
+class CachedModel:
+    '''A GECToR whose outputs are cached per input, to predict with many thresholds.
+
+    keep_confidence and min_error_prob of GECToR.predict() only change how the labels are
+        chosen from the probabilities. So for each input (the subword ids of a sentence or
+        a window), only what this choice needs is kept: at every position, the probability
+        of $KEEP, the most probable other label and its probability, and the error probability.
+        An input is passed to the encoder once, however many thresholds it is predicted with,
+        and the labels are the same as those of GECToR.predict().
+
+    It can be passed to predict() in place of the model, also from several threads at once.
+        top_k and return_labels of GECToR.predict() are not supported.
+
+    Args:
+        model (GECToR): The model.
+        pad_token_id (int): The padding id of the tokenizer, e.g. 1 for RoBERTa.
+    '''
+    def __init__(self, model: GECToR, pad_token_id: int):
+        self.model = model
+        self.pad_token_id = pad_token_id
+        self.config = model.config
+        self.device = model.device
+        self.keep_index = self.config.label2id[self.config.keep_label]
+        self.incor_index = self.config.d_label2id[self.config.incorrect_label]
+        self.n_forward = 0  # The number of inputs passed to the encoder.
+        self.n_lookup = 0
+        self._stats = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def _forward(self, rows: List[Tuple[int, ...]]) -> List[torch.Tensor]:
+        max_len = max(len(row) for row in rows)
+        input_ids = torch.full((len(rows), max_len), self.pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(rows), max_len), dtype=torch.long)
+        for k, row in enumerate(rows):
+            input_ids[k, :len(row)] = torch.tensor(row, dtype=torch.long)
+            attention_mask[k, :len(row)] = 1
+        with torch.no_grad():
+            outputs = self.model(input_ids.to(self.device), attention_mask.to(self.device))
+            probability_labels = F.softmax(outputs.logits_labels.float(), dim=-1)
+            probability_d = F.softmax(outputs.logits_d.float(), dim=-1)
+            keep = probability_labels[:, :, self.keep_index].clone()
+            probability_labels[:, :, self.keep_index] = -1
+            # The first one of equal probabilities, like torch.argmax() in GECToR.predict().
+            best_ids = torch.argmax(probability_labels, dim=-1)
+            best = probability_labels.gather(2, best_ids.unsqueeze(-1)).squeeze(-1)
+            error = probability_d[:, :, self.incor_index]
+            # (n_rows, 4, max_len)
+            stats = torch.stack([keep, best, best_ids.to(keep.dtype), error], dim=1).cpu()
+        return [stats[k, :, :len(row)] for k, row in enumerate(rows)]
+
+    def _lookup(self, rows: List[Tuple[int, ...]]) -> List[torch.Tensor]:
+        found = {}
+        while len(found) < len(set(rows)):
+            mine, waiting = [], []
+            with self._lock:
+                for row in set(rows):
+                    if row in found:
+                        continue
+                    if row in self._stats:
+                        found[row] = self._stats[row]
+                    elif row in self._inflight:
+                        waiting.append(self._inflight[row])
+                    else:
+                        # Other threads wait for this thread instead of computing it again.
+                        self._inflight[row] = threading.Event()
+                        mine.append(row)
+            try:
+                if mine != []:
+                    for row, stats in zip(mine, self._forward(mine)):
+                        found[row] = stats
+                    with self._lock:
+                        self._stats.update((row, found[row]) for row in mine)
+                        self.n_forward += len(mine)
+            finally:
+                with self._lock:
+                    for row in mine:
+                        self._inflight.pop(row).set()
+            for event in waiting:
+                event.wait()
+        with self._lock:
+            self.n_lookup += len(rows)
+        return [found[row] for row in rows]
+
+    def predict(
+        self,
+        input_ids: torch.Tensor,
+        attention_mask: torch.Tensor,
+        word_masks: torch.Tensor,
+        keep_confidence: float=0,
+        min_error_prob: float=0,
+        word_index: Optional[torch.Tensor]=None,
+        return_labels: bool=True,
+        top_k: int=0
+    ) -> GECToRPredictionOutput:
+        '''GECToR.predict() from the cached statistics, with word_label_ids and max_error_probability.'''
+        lengths = attention_mask.sum(dim=1).tolist()
+        rows = [tuple(ids[:n]) for ids, n in zip(input_ids.tolist(), lengths)]
+        # Padding is never chosen: $KEEP has probability 1 there.
+        stats = torch.zeros((len(rows), 4, input_ids.size(1)))
+        stats[:, 0] = 1
+        for k, row_stats in enumerate(self._lookup(rows)):
+            stats[k, :, :row_stats.size(1)] = row_stats
+        keep, best, best_ids, error = stats.unbind(dim=1)
+        best_ids = best_ids.long()
+        keep = keep + keep_confidence
+        keep_wins = (keep > best) | ((keep == best) & (self.keep_index < best_ids))
+        pred_label_ids = torch.where(keep_wins, torch.full_like(best_ids, self.keep_index), best_ids)
+        max_error_probability = torch.max(error * word_masks.cpu(), dim=-1)[0]
+        pred_label_ids[max_error_probability < min_error_prob, :] = self.keep_index
+        pred_label_ids[torch.maximum(keep, best) < min_error_prob] = self.keep_index
+        word_label_ids = None
+        if word_index is not None:
+            word_label_ids = pred_label_ids.gather(1, word_index.cpu())
+        return GECToRPredictionOutput(
+            pred_label_ids=pred_label_ids,
+            max_error_probability=max_error_probability,
+            word_label_ids=word_label_ids
+        )
+
+def sweep_thresholds(
+    model: GECToR,
+    tokenizer: PreTrainedTokenizer,
+    srcs: List[str],
+    encode: dict,
+    decode: dict,
+    grid: List[Tuple[float, float]],
+    n_workers: int=1,
+    **predict_args
+) -> Tuple[Dict[Tuple[float, float], List[str]], CachedModel]:
+    '''Correct the sentences with every (keep_confidence, min_error_prob) of the grid.
+
+    The cells share a CachedModel, so every distinct intermediate sentence is passed to the
+        encoder once, and they are run by n_workers threads. On CPU, the intra-op threads of
+        torch are divided between them during the sweep, so that they do not oversubscribe
+        the cores. predict_args are passed to predict(), e.g. batch_size and n_iteration.
+
+    Returns:
+        The corrected sentences of each cell, and the CachedModel, e.g. for its n_forward.
+    '''
+    cached = CachedModel(model, tokenizer.pad_token_id)
+    local = threading.local()
+    def run(cell: Tuple[float, float]) -> List[str]:
+        # The fast tokenizer can not be used from several threads at once.
+        if not hasattr(local, 'tokenizer'):
+            local.tokenizer = copy.deepcopy(tokenizer)
+        keep_confidence, min_error_prob = cell
+        return predict(
+            cached,
+            local.tokenizer,
+            srcs,
+            encode,
+            decode,
+            keep_confidence=keep_confidence,
+            min_error_prob=min_error_prob,
+            **predict_args
+        )
+    num_threads = torch.get_num_threads()
+    if n_workers > 1 and model.device.type == 'cpu':
+        torch.set_num_threads(max(1, num_threads // n_workers))
+    try:
+        with ThreadPoolExecutor(max_workers=n_workers, thread_name_prefix='gector-sweep') as executor:
+            results = list(executor.map(run, grid))
+    finally:
+        torch.set_num_threads(num_threads)
+    return dict(zip(grid, results)), cached
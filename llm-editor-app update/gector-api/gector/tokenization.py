@@ -0,0 +1,229 @@
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import torch
+from transformers import PreTrainedTokenizer
+from .metrics import REGISTRY
+
+class IncrementalEncoder:
+    '''Build encoder inputs of sentences split into words, tokenizing each distinct word once.
+
+    Words that were split into words beforehand are tokenized independently of each other,
+    so the subword ids of a word can be cached. Across the iterations of predict() most
+    words do not change, and only new or edited words are passed to the tokenizer.
+    The result is the same as
+        tokenizer(srcs, is_split_into_words=True, truncation=True, max_length=max_length)
+
+    Like the tokenizer, an encoder must not be used from several threads at once.
+    Use get_incremental_encoder() to get the encoder of a tokenizer.
+
+    Args:
+        tokenizer (PreTrainedTokenizer): The tokenizer.
+        max_words (int): The maximum number of words in the LRU cache.
+    '''
+    def __init__(self, tokenizer: PreTrainedTokenizer, max_words: int=100000):
+        self.tokenizer = tokenizer
+        self.max_words = max_words
+        self._subwords = OrderedDict()  # word -> subword ids
+        self.pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else 0
+        # The special tokens around a sentence, e.g. <s> and </s>.
+        with_special = tokenizer.build_inputs_with_special_tokens([-1])
+        position = with_special.index(-1)
+        self._prefix = with_special[:position]
+        self._suffix = with_special[position+1:]
+
+    def _lookup(self, words: List[str]) -> Dict[str, List[int]]:
+        found = {}
+        missing = []
+        for word in words:
+            if word in found:
+                continue
+            ids = self._subwords.get(word)
+            if ids is None:
+                missing.append(word)
+                found[word] = None
+            else:
+                self._subwords.move_to_end(word)
+                found[word] = ids
+        REGISTRY.counter(
+            'gector_subword_cache_total', 'Lookups of the word to subword cache', result='hit'
+        ).inc(len(found) - len(missing))
+        REGISTRY.counter(
+            'gector_subword_cache_total', 'Lookups of the word to subword cache', result='miss'
+        ).inc(len(missing))
+        if missing != []:
+            encoded = self.tokenizer(
+                [[word] for word in missing],
+                is_split_into_words=True,
+                add_special_tokens=False
+            )['input_ids']
+            for word, ids in zip(missing, encoded):
+                found[word] = ids
+                self._subwords[word] = ids
+            while len(self._subwords) > self.max_words:
+                self._subwords.popitem(last=False)
+        return found
+
+    def encode(
+        self,
+        srcs: List[List[str]],
+        max_length: int,
+        add_special_tokens: bool=True
+    ) -> Tuple[List[List[int]], List[List[Optional[int]]]]:
+        '''Encode sentences split into words.
+
+        Returns:
+            The subword ids and the word index of each subword (None for special tokens)
+                of each sentence, truncated to max_length subwords.
+        '''
+        subwords = self._lookup([word for src in srcs for word in src])
+        prefix = self._prefix if add_special_tokens else []
+        suffix = self._suffix if add_special_tokens else []
+        max_n_subwords = max_length - len(prefix) - len(suffix)
+        all_input_ids = []
+        all_word_ids = []
+        for src in srcs:
+            input_ids = list(prefix)
+            word_ids = [None] * len(prefix)
+            for i, word in enumerate(src):
+                ids = subwords[word]
+                input_ids += ids
+                word_ids += [i] * len(ids)
+                if len(input_ids) - len(prefix) >= max_n_subwords:
+                    break
+            del input_ids[len(prefix) + max_n_subwords:]
+            del word_ids[len(prefix) + max_n_subwords:]
+            all_input_ids.append(input_ids + suffix)
+            all_word_ids.append(word_ids + [None] * len(suffix))
+        return all_input_ids, all_word_ids
+
+    def word_lengths(self, src: List[str]) -> List[int]:
+        '''The number of subwords of each word.'''
+        subwords = self._lookup(src)
+        return [len(subwords[word]) for word in src]
+
+    def n_special_tokens(self, add_special_tokens: bool=True) -> int:
+        '''The number of special tokens added to a sentence by encode().'''
+        return len(self._prefix) + len(self._suffix) if add_special_tokens else 0
+
+    def build_batch(
+        self,
+        input_ids: List[List[int]],
+        word_ids: List[List[Optional[int]]]
+    ) -> Dict[str, torch.Tensor]:
+        '''Pad encoded sentences to the longest one and build the input tensors of GECToR.
+
+        Besides input_ids, attention_mask and word_masks, the result has word_ids,
+            the word index of each subword (-1 for special tokens and padding).
+        '''
+        max_len = max(len(ids) for ids in input_ids)
+        batch_input_ids = torch.full((len(input_ids), max_len), self.pad_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(input_ids), max_len), dtype=torch.long)
+        for k, ids in enumerate(input_ids):
+            batch_input_ids[k, :len(ids)] = torch.tensor(ids, dtype=torch.long)
+            attention_mask[k, :len(ids)] = 1
+        batch_word_ids = word_ids_to_tensor(word_ids, max_len)
+        return {
+            'input_ids': batch_input_ids,
+            'attention_mask': attention_mask,
+            'word_masks': word_masks_from_word_ids(batch_word_ids),
+            'word_ids': batch_word_ids
+        }
+
+    def __len__(self) -> int:
+        return len(self._subwords)
+
+def make_windows(lengths: List[int], max_subwords: int) -> List[Tuple[int, int]]:
+    '''Split a sentence into overlapping windows of words.
+
+    Every window has at most max_subwords subwords (or is a single word), and starts
+        about in the middle of the previous one, so every word but those near the ends
+        of the sentence is far from the edges of some window.
+
+    Args:
+        lengths (List[int]): The number of subwords of each word.
+        max_subwords (int): The maximum number of subwords of a window.
+
+    Returns:
+        (start, end) word indices of the windows, which cover all the words.
+    '''
+    windows = []
+    start = 0
+    while True:
+        end = start
+        n_subwords = 0
+        while end < len(lengths) and (end == start or n_subwords + lengths[end] <= max_subwords):
+            n_subwords += lengths[end]
+            end += 1
+        windows.append((start, end))
+        if end >= len(lengths):
+            return windows
+        # The next window starts after the first half of the subwords of this one.
+        next_start = start + 1
+        n_subwords = lengths[start]
+        while next_start < end - 1 and n_subwords < max_subwords // 2:
+            n_subwords += lengths[next_start]
+            next_start += 1
+        # It has to reach beyond this window.
+        while next_start < end and sum(lengths[next_start:end+1]) > max_subwords:
+            next_start += 1
+        start = next_start
+
+def window_centrality(position: int, start: int, end: int, n_words: int) -> float:
+    '''How far a word is from the edges of a window, for choosing the window of a word.
+
+    The ends of the sentence are not counted as edges, because a word there has all of its context.
+    '''
+    left = position - start if start > 0 else float('inf')
+    right = end - 1 - position if end < n_words else float('inf')
+    return min(left, right)
+
+def word_ids_to_tensor(word_ids: List[List[Optional[int]]], length: int) -> torch.Tensor:
+    '''(batch, length) tensor of word indices, -1 for None and padding.'''
+    tensor = torch.full((len(word_ids), length), -1, dtype=torch.long)
+    for k, wids in enumerate(word_ids):
+        tensor[k, :len(wids)] = torch.tensor([-1 if i is None else i for i in wids], dtype=torch.long)
+    return tensor
+
+def word_masks_from_word_ids(word_ids: torch.Tensor) -> torch.Tensor:
+    '''1 where the word index differs from the previous subword's, like get_word_masks_from_word_ids().
+
+    As there, the previous index of the first position is 0, so without special tokens
+        the first word is not masked.
+    '''
+    previous = torch.cat([torch.zeros_like(word_ids[:, :1]), word_ids[:, :-1]], dim=1)
+    return ((word_ids >= 0) & (word_ids != previous)).long()
+
+def first_subword_index(word_ids: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    '''The position of the first subword of each word.
+
+    Word indices are expected to be non-decreasing, with -1 only before and after the words.
+
+    Args:
+        word_ids (torch.Tensor): (batch, seq_len) word indices, -1 for special tokens and padding.
+
+    Returns:
+        (batch, max_words) positions to gather from, and a (batch, max_words) mask of
+            valid words, since sentences have different numbers of words.
+    '''
+    previous = torch.cat([torch.full_like(word_ids[:, :1], -1), word_ids[:, :-1]], dim=1)
+    first = (word_ids >= 0) & (word_ids != previous)
+    n_words = first.sum(dim=1)
+    max_words = int(n_words.max()) if first.numel() > 0 else 0
+    # A stable sort moves the positions of the first subwords to the front in order.
+    index = torch.sort((~first).to(torch.uint8), dim=1, stable=True).indices[:, :max_words]
+    valid = torch.arange(max_words, device=word_ids.device).unsqueeze(0) < n_words.unsqueeze(1)
+    return index, valid
+
+_encoders = weakref.WeakKeyDictionary()
+_encoders_lock = threading.Lock()
+
+def get_incremental_encoder(tokenizer: PreTrainedTokenizer) -> IncrementalEncoder:
+    '''The IncrementalEncoder of a tokenizer, which is kept as long as the tokenizer.'''
+    with _encoders_lock:
+        encoder = _encoders.get(tokenizer)
+        if encoder is None:
+            encoder = IncrementalEncoder(tokenizer)
+            _encoders[tokenizer] = encoder
+        return encoder
@@ -1,10 +1,37 @@
+import os
+
+# with a local artifact directory (see download_artifacts.py) everything is loaded from it without
+# network access; this has to be set before transformers is imported
+ARTIFACT_DIR = os.environ.get('GECTOR_ARTIFACT_DIR')
+if ARTIFACT_DIR:
+    for name in ['HF_HUB_CACHE', 'HUGGINGFACE_HUB_CACHE']:
+        os.environ.setdefault(name, ARTIFACT_DIR)
+    for name in ['HF_HUB_OFFLINE', 'TRANSFORMERS_OFFLINE']:
+        os.environ.setdefault(name, '1')
+
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import List, Dict, Any
-from gector import GECToR, predict, load_verb_dict
+from typing import List, Dict, Any, Optional, Tuple
+from gector import (
+    GECToR, ExportedGECToR, predict, load_verb_dict, IterativeScheduler,
+    MicroBatcher, ContinuousBatcher, QueueFullError, split_sentences
+)
+from gector.segmentation import tokenize_words, project_edits, apply_replacements
+from gector.precision import set_precision
+from gector.replicas import ReplicaPool
+from gector.cache import CorrectionCache, VersionStore
+from gector.metrics import REGISTRY
 from transformers import AutoTokenizer
+import asyncio
+import copy
+import functools
+import hashlib
+import json
 import logging
+import threading
 import time
 
 # configure the log
@@ -17,102 +44,421 @@ logger = logging.getLogger(__name__)
 
 app = FastAPI(title="Grammar Correction API")
 
-    # add CORS middleware, allow frontend access
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # allow all origins, please change to specific domain in production environment
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+def resolve_revision(model_id: str, revision: str) -> str:
+    """
+    the commit hash of a branch or tag in the artifact directory, e.g. "main" as downloaded at build time,
+    so that the loaded weights, /health/ready and the cache key all name the exact commit
+    """
+    if ARTIFACT_DIR:
+        ref = os.path.join(ARTIFACT_DIR, f"models--{model_id.replace('/', '--')}", 'refs', revision)
+        if os.path.exists(ref):
+            with open(ref) as f:
+                return f.read().strip()
+    return revision
+
+model_id = os.environ.get('GECTOR_MODEL_ID', 'gotutiyan/gector-roberta-base-5k')
+# pin the revision of the model (a commit hash) so that a restart can not silently pick up new weights;
+# a branch or tag is resolved to the commit that was downloaded into GECTOR_ARTIFACT_DIR
+model_revision = resolve_revision(model_id, os.environ.get('GECTOR_MODEL_REVISION', 'main'))
+verb_file = os.environ.get('GECTOR_VERB_FILE', 'data/verb-form-vocab.txt')
+# "torch" runs the model in PyTorch; "onnx" or "torchscript" run the graph exported by gector-export
+# (model, config and tokenizer) from GECTOR_EXPORTED_DIR on CPU instead
+BACKEND = os.environ.get('GECTOR_BACKEND', 'torch')
+EXPORTED_DIR = os.environ.get('GECTOR_EXPORTED_DIR')
+# "fp32", "int8" (dynamically quantized encoder) or "bf16" for the torch backend;
+# check the quality first with gector-predict --precision_check
+PRECISION = os.environ.get('GECTOR_PRECISION', 'fp32')
+# with more than 1, the torch model runs in this many processes pinned to their own cores (per API worker)
+REPLICAS = int(os.environ.get('GECTOR_REPLICAS', 0))
+# identifies the model in the cache key; an exported graph or a lower precision may round differently
+MODEL_KEY = f"{model_id}@{model_revision}" + ("" if BACKEND == 'torch' else f"/{BACKEND}") \
+    + ("" if PRECISION == 'fp32' else f"/{PRECISION}")
+model = tokenizer = encode = decode = None
+PROCESS_START = time.time()
+# reported by /health/ready; status goes starting -> loading -> warming_up -> ready (or failed)
+startup = {
+    "status": "starting",
+    "load_seconds": None,
+    "warmup_seconds": None,
+    "cold_start_seconds": None,
+    "error": None
+}
+
+def load_artifacts():
+    """
+    load the model, tokenizer and verb dictionary once per process;
+    run_server.py calls this before forking workers so that they share the weights
+    """
+    global model, tokenizer, encode, decode
+    if model is not None:
+        return
+    try:
+        if BACKEND != 'torch':
+            if PRECISION != 'fp32':
+                raise ValueError(f"GECTOR_PRECISION={PRECISION} is only supported by the torch backend, not {BACKEND}")
+            logger.info(f"Loading exported {BACKEND} model from {EXPORTED_DIR}...")
+            model = ExportedGECToR(EXPORTED_DIR, BACKEND)
+            tokenizer = AutoTokenizer.from_pretrained(EXPORTED_DIR)
+        else:
+            logger.info(f"Loading model {model_id}@{model_revision}...")
+            model = set_precision(GECToR.from_pretrained(model_id, revision=model_revision), PRECISION)
+            tokenizer = AutoTokenizer.from_pretrained(model_id, revision=model_revision)
+            if REPLICAS > 1:
+                # the replica processes are started by the first prediction, i.e. after the fork of the workers
+                model = ReplicaPool(model, REPLICAS)
+        encode, decode = load_verb_dict(verb_file)
+        logger.info("Model loaded successfully")
+    except Exception as e:
+        logger.error(f"Error loading model: {e}")
+        raise
+
+# requests arriving within the wait window are corrected in one predict() call
+BATCH_MAX_WAIT_MS = float(os.environ.get('GECTOR_BATCH_MAX_WAIT_MS', 5))
+BATCH_MAX_SIZE = int(os.environ.get('GECTOR_BATCH_MAX_SIZE', 32))
+BATCH_MAX_TOKENS = int(os.environ.get('GECTOR_BATCH_MAX_TOKENS', 4096))
+# with more than 0, the forward batches of a predict call are collated and aligned on helper threads
+# during the forward passes; this only helps when a call has several batches
+PIPELINE_DEPTH = int(os.environ.get('GECTOR_PIPELINE_DEPTH', 0))
+# with continuous batching, sentences join and leave the running batch between correction iterations
+CONTINUOUS_BATCHING = os.environ.get('GECTOR_CONTINUOUS_BATCHING', '1') == '1'
+# inference runs on its own threads so that the event loop stays responsive;
+# requests beyond the pending limit are rejected with 503 instead of queueing forever
+INFERENCE_WORKERS = int(os.environ.get('GECTOR_INFERENCE_WORKERS', 1))
+MAX_PENDING = int(os.environ.get('GECTOR_MAX_PENDING', 64))
+RETRY_AFTER = int(os.environ.get('GECTOR_RETRY_AFTER', 1))
+# prediction settings, they are also part of the cache key
+KEEP_CONFIDENCE = float(os.environ.get('GECTOR_KEEP_CONFIDENCE', 0))
+MIN_ERROR_PROB = float(os.environ.get('GECTOR_MIN_ERROR_PROB', 0))
+N_ITERATION = int(os.environ.get('GECTOR_N_ITERATION', 5))
+# number of alternative tags returned with the confidence of each correction (0 disables the scores)
+TOP_K = int(os.environ.get('GECTOR_TOP_K', 3))
+# corrected sentences are cached; set GECTOR_CACHE_DB to share the cache between workers
+CACHE_SIZE = int(os.environ.get('GECTOR_CACHE_SIZE', 10000))
+CACHE_TTL = float(os.environ.get('GECTOR_CACHE_TTL', 3600))
+CACHE_DB = os.environ.get('GECTOR_CACHE_DB')
+# document versions remembered for /correct/incremental, by number and by total size;
+# with GECTOR_CACHE_DB they are shared between the workers as well
+MAX_VERSIONS = int(os.environ.get('GECTOR_MAX_VERSIONS', 1000))
+MAX_VERSION_BYTES = int(os.environ.get('GECTOR_MAX_VERSION_BYTES', 64 * 1024 * 1024))
+# sentence lengths (in words) run once before the server reports ready, so real users don't pay first-call costs
+WARMUP_LENGTHS = [int(n) for n in os.environ.get('GECTOR_WARMUP_LENGTHS', '8,32,64').split(',') if n.strip()]
+WARMUP_BATCH_SIZE = int(os.environ.get('GECTOR_WARMUP_BATCH_SIZE', 4))
+batcher = None
+# opened by the startup hook of each worker: a SQLite connection must not be inherited across fork
+cache = None
+versions = None
+# sentences that are being corrected right now, so identical requests wait for the same prediction
+_inflight: Dict[str, asyncio.Future] = {}
+_thread_local = threading.local()
+
+def get_tokenizer():
+    # the fast tokenizer can not be used from several threads at once, so every thread gets its own copy
+    if not hasattr(_thread_local, 'tokenizer'):
+        _thread_local.tokenizer = copy.deepcopy(tokenizer)
+    return _thread_local.tokenizer
+
+def count_subwords(text: str) -> int:
+    return len(get_tokenizer().tokenize(text))
+
+def predict_batch(srcs: List[str], callback=None) -> List[Tuple[str, List[Dict[str, Any]]]]:
+    """
+    correct sentences and return (corrected sentence, word-level edits) for each of them;
+    predict() sorts them by length itself, so that sentences of similar length share a forward batch
+    """
+    return predict(
+        model,
+        get_tokenizer(),
+        srcs,
+        encode,
+        decode,
+        keep_confidence=KEEP_CONFIDENCE,
+        min_error_prob=MIN_ERROR_PROB,
+        n_iteration=N_ITERATION,
+        callback=callback,
+        return_edits=True,
+        top_k=TOP_K,
+        pipeline_depth=PIPELINE_DEPTH
+    )
+
+def make_scheduler() -> IterativeScheduler:
+    # called from each inference thread, so the scheduler gets the tokenizer of that thread
+    return IterativeScheduler(
+        model,
+        get_tokenizer(),
+        encode,
+        decode,
+        keep_confidence=KEEP_CONFIDENCE,
+        min_error_prob=MIN_ERROR_PROB,
+        batch_size=BATCH_MAX_SIZE,
+        n_iteration=N_ITERATION,
+        max_batch_tokens=BATCH_MAX_TOKENS,
+        return_edits=True,
+        top_k=TOP_K,
+        pipeline_depth=PIPELINE_DEPTH
+    )
+
+def warm_up():
+    words = "this are a example sentences which contain a error or two .".split()
+    for length in WARMUP_LENGTHS:
+        text = ' '.join((words * (length // len(words) + 1))[:length])
+        # through the batcher, so that the inference threads are warmed up as well
+        batcher.submit([text] * WARMUP_BATCH_SIZE).result()
+
+def load_and_warm_up():
+    try:
+        startup["status"] = "loading"
+        start = time.time()
+        load_artifacts()
+        startup["load_seconds"] = round(time.time() - start, 3)
+        startup["status"] = "warming_up"
+        start = time.time()
+        warm_up()
+        startup["warmup_seconds"] = round(time.time() - start, 3)
+        startup["cold_start_seconds"] = round(time.time() - PROCESS_START, 3)
+        startup["status"] = "ready"
+        REGISTRY.gauge(
+            'gector_cold_start_seconds', 'Seconds from process start until the model was ready'
+        ).set(startup["cold_start_seconds"])
+        logger.info(
+            f"Ready in {startup['cold_start_seconds']}s "
+            f"(load {startup['load_seconds']}s, warmup {startup['warmup_seconds']}s)"
+        )
+    except Exception as e:
+        startup["status"] = "failed"
+        startup["error"] = str(e)
+        logger.exception("Startup failed")
 
-# initialize the model once
-try:
-    logger.info("Loading model...")
-    model_id = 'gotutiyan/gector-roberta-base-5k'
-    model = GECToR.from_pretrained(model_id)
-    tokenizer = AutoTokenizer.from_pretrained(model_id)
-    encode, decode = load_verb_dict('data/verb-form-vocab.txt')
-    logger.info("Model loaded successfully")
-except Exception as e:
-    logger.error(f"Error loading model: {e}")
-    raise
+@app.on_event("startup")
+async def start_batcher():
+    global batcher, cache, versions
+    if CACHE_SIZE > 0:
+        cache = CorrectionCache(CACHE_SIZE, CACHE_TTL, CACHE_DB)
+    versions = VersionStore(MAX_VERSIONS, MAX_VERSION_BYTES, CACHE_DB)
+    if CONTINUOUS_BATCHING:
+        batcher = ContinuousBatcher(
+            make_scheduler,
+            max_batch_size=BATCH_MAX_SIZE,
+            n_workers=INFERENCE_WORKERS,
+            max_pending=MAX_PENDING
+        )
+    else:
+        batcher = MicroBatcher(
+            predict_batch,
+            max_wait_ms=BATCH_MAX_WAIT_MS,
+            max_batch_size=BATCH_MAX_SIZE,
+            max_batch_tokens=BATCH_MAX_TOKENS,
+            length_fn=count_subwords,
+            n_workers=INFERENCE_WORKERS,
+            max_pending=MAX_PENDING
+        )
+    # load in the background so that the liveness probe answers while the model is loading
+    threading.Thread(target=load_and_warm_up, name='gector-startup', daemon=True).start()
+
+@app.on_event("shutdown")
+async def stop_batcher():
+    batcher.close()
+    if isinstance(model, ReplicaPool):
+        model.close()
+
+def _cache_result(key: str, result: Tuple[str, List[Dict[str, Any]]]):
+    if cache is not None:
+        asyncio.get_running_loop().run_in_executor(None, cache.put, key, json.dumps(result))
+
+def _resolve_inflight(key: str, future: asyncio.Future, corrected: Tuple[str, List[Dict[str, Any]]]):
+    # cached as soon as it is resolved, so that an identical sentence arriving before
+    # the rest of the job is done finds it instead of correcting it again
+    if _inflight.get(key) is future:
+        del _inflight[key]
+    if not future.done():
+        future.set_result(corrected)
+        _cache_result(key, corrected)
+
+def _finish_inflight(own: Dict[str, asyncio.Future], job: asyncio.Future):
+    # the results were usually delivered one by one, only what is left is settled here;
+    # a key may already belong to a newer request, whose future must not be touched
+    error = job.exception()
+    results = job.result() if error is None else [None] * len(own)
+    for (key, future), result in zip(own.items(), results):
+        if _inflight.get(key) is future:
+            del _inflight[key]
+        if future.done():
+            continue
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+            _cache_result(key, result)
+
+async def submit_sentences(srcs: List[str]) -> List[asyncio.Future]:
+    """
+    start correcting whitespace-normalized sentences, reusing cached and in-flight results;
+    each returned future is resolved as soon as its own sentence is corrected
+    """
+    keys = [
+        CorrectionCache.make_key(src, MODEL_KEY, KEEP_CONFIDENCE, MIN_ERROR_PROB, N_ITERATION, TOP_K)
+        for src in srcs
+    ]
+    cached = await run_in_threadpool(cache.get_many, keys) if cache is not None else [None] * len(srcs)
+    loop = asyncio.get_running_loop()
+    futures = []
+    missing = {}
+    for key, src, result in zip(keys, srcs, cached):
+        if result is not None:
+            future = loop.create_future()
+            future.set_result(tuple(json.loads(result)))
+            futures.append(future)
+            continue
+        if key in _inflight:
+            if cache is not None:
+                cache.count_coalesced()
+        else:
+            missing[key] = src
+        futures.append(None)
+    if missing:
+        own = {key: loop.create_future() for key in missing}
+        owned = list(own.items())
+        # the prediction resolves the shared futures itself, so a cancelled request
+        # does not leave other requests waiting for the same sentence
+        job = asyncio.wrap_future(batcher.submit(
+            list(missing.values()),
+            on_result=lambda i, sent: loop.call_soon_threadsafe(_resolve_inflight, *owned[i], sent)
+        ))
+        _inflight.update(own)
+        job.add_done_callback(functools.partial(_finish_inflight, own))
+    return [future if future is not None else _inflight[key] for key, future in zip(keys, futures)]
+
+async def correct_sentences(srcs: List[str]) -> List[Tuple[str, List[Dict[str, Any]]]]:
+    futures = await submit_sentences(srcs)
+    return [await asyncio.shield(future) for future in futures]
 
 class SentenceInput(BaseModel):
     text: str
 
-def compare_sentences(original: str, corrected: str) -> List[Dict[str, Any]]:
+class BatchInput(BaseModel):
+    texts: List[str] = []
+    text: Optional[str] = None
+
+class IncrementalInput(BaseModel):
+    text: str
+    version: Optional[str] = None
+
+def observe_request(endpoint: str, seconds: float):
+    REGISTRY.histogram(
+        'gector_request_seconds', 'Total latency of correction requests', endpoint=endpoint
+    ).observe(seconds)
+
+def count_error(endpoint: str, reason: str):
+    REGISTRY.counter(
+        'gector_errors_total', 'Number of failed or rejected requests', endpoint=endpoint, reason=reason
+    ).inc()
+
+def overloaded_response(**content) -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        headers={"Retry-After": str(RETRY_AFTER)},
+        content={"error": "Server is busy, please retry later", **content}
+    )
+
+def model_input(text: str, start: int=0, end: Optional[int]=None) -> Tuple[str, List[Tuple[int, int]]]:
     """
-    compare the original sentence and the corrected sentence, return a structured change list
+    the words of text[start:end] joined by spaces, as the model expects them,
+    and their character spans in text, so that the edits can be mapped back to text
+    """
+    spans = tokenize_words(text, start, end)
+    return ' '.join(text[s:e] for s, e in spans), spans
+
+def build_corrections(text: str, spans: List[Tuple[int, int]], edits: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    map the word-level edits of the model to character offsets in text;
+    replacing text[startIndex:endIndex] by corrected applies a correction
     """
     corrections = []
-    
-    if original == corrected:
-        return corrections
-    
-    # compare by word level
-    orig_tokens = original.split()
-    corr_tokens = corrected.split()
-    
-    # find the position of each word in the original sentence (startIndex and endIndex)
-    word_positions = []
-    start_idx = 0
-    for word in orig_tokens:
-        start_pos = original.find(word, start_idx)
-        if start_pos != -1:
-            end_pos = start_pos + len(word)
-            word_positions.append((start_pos, end_pos))
-            start_idx = end_pos
-    
-    # compare the words before and after correction
-    for i, (o_token, c_token) in enumerate(zip(orig_tokens, corr_tokens)):
-        if o_token != c_token:
-            # if the word is different, add a correction
-            correction_type = "spelling" if len(o_token) == len(c_token) else "grammar"
-            start_pos, end_pos = word_positions[i] if i < len(word_positions) else (0, 0)
-            
-            corrections.append({
-                "id": i + 1,
-                "type": correction_type,
-                "original": o_token,
-                "corrected": c_token,
-                "startIndex": start_pos,
-                "endIndex": end_pos,
-                "message": f"Suggested correction: '{o_token}' → '{c_token}'" 
-            })
-    
-    # handle the case of different lengths
-    if len(orig_tokens) < len(corr_tokens):
-        # there are added words
-        for i in range(len(orig_tokens), len(corr_tokens)):
-            corrections.append({
-                "id": i + 1,
-                "type": "missing",
-                "original": "",
-                "corrected": corr_tokens[i],
-                "startIndex": len(original) if i == len(orig_tokens) else word_positions[i-1][1],
-                "endIndex": len(original) if i == len(orig_tokens) else word_positions[i-1][1],
-                "message": f"Missing word: '{corr_tokens[i]}'"
-            })
-    elif len(orig_tokens) > len(corr_tokens):
-        # there are deleted words
-        for i in range(len(corr_tokens), len(orig_tokens)):
-            corrections.append({
-                "id": i + 1,
-                "type": "redundant",
-                "original": orig_tokens[i],
-                "corrected": "",
-                "startIndex": word_positions[i][0],
-                "endIndex": word_positions[i][1],
-                "message": f"Redundant word: '{orig_tokens[i]}'"
-            })
-    
+    for edit, projected in zip(edits, project_edits(text, spans, edits)):
+        if projected is None:
+            continue
+        start_pos, end_pos, corrected = projected
+        original = text[start_pos:end_pos]
+        if edit["type"] == "insert":
+            message = f"Missing word: '{edit['corrected']}'"
+        elif edit["type"] == "delete":
+            message = f"Redundant word: '{text[spans[edit['start']][0]:spans[edit['end']-1][1]]}'"
+        else:
+            message = f"Suggested correction: '{original}' → '{corrected}'"
+        corrections.append({
+            "id": len(corrections) + 1,
+            "type": edit["type"],
+            "original": original,
+            "corrected": corrected,
+            "startIndex": start_pos,
+            "endIndex": end_pos,
+            "tags": edit["tags"],
+            "message": message,
+            **correction_confidence(edit.get("scores"))
+        })
     return corrections
 
+def correction_confidence(scores: Optional[List[Dict[str, Any]]]) -> Dict[str, Any]:
+    """
+    the confidence of a correction from the scores of its tags; a correction needs all of its tags,
+    so its probability is the lowest tag probability and its error probability the highest one
+    """
+    if not scores:
+        return {"probability": None, "errorProbability": None, "scores": []}
+    return {
+        "probability": min(s["probability"] for s in scores),
+        "errorProbability": max(s["error_probability"] for s in scores),
+        "scores": [
+            {
+                "tag": s["tag"],
+                "probability": s["probability"],
+                "errorProbability": s["error_probability"],
+                "alternatives": s["alternatives"]
+            }
+            for s in scores
+        ]
+    }
+
+def apply_corrections(text: str, corrections: List[Dict[str, Any]], start: int=0, end: Optional[int]=None) -> str:
+    # the text outside the corrections is kept as it is, including line breaks and repeated spaces
+    return apply_replacements(text, [(c["startIndex"], c["endIndex"], c["corrected"]) for c in corrections], start, end)
+
+@app.middleware("http")
+async def require_ready(request: Request, call_next):
+    # correction requests are refused until the model is loaded and warmed up; preflights always pass
+    if request.method != "OPTIONS" and request.url.path.startswith("/correct") and startup["status"] != "ready":
+        return JSONResponse(
+            status_code=503,
+            headers={"Retry-After": str(RETRY_AFTER)},
+            content={"error": f"Model is not ready ({startup['status']})", "corrections": []}
+        )
+    return await call_next(request)
+
+# add CORS middleware, allow frontend access;
+# added after require_ready so that it is the outer layer and the 503s during startup (and preflights) get CORS headers
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],  # allow all origins, please change to specific domain in production environment
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+
 @app.get("/")
 async def root():
     return {"message": "GECToR Grammar Correction API is running"}
 
+@app.get("/health/live")
+async def liveness():
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness():
+    content = {"model_id": model_id, "model_revision": model_revision, "backend": BACKEND, "precision": PRECISION,
+               "replicas": len(model) if isinstance(model, ReplicaPool) else 1, **startup}
+    if startup["status"] != "ready":
+        return JSONResponse(status_code=503, content=content)
+    return content
+
 @app.post("/correct")
 async def correct(input: SentenceInput):
     start_time = time.time()
@@ -120,12 +466,15 @@ async def correct(input: SentenceInput):
     
     try:
         original = input.text
-        corrected = predict(model, tokenizer, [original], encode, decode)[0]
+        src, spans = model_input(original)
+        _, edits = (await correct_sentences([src]))[0]
         
-        # use the improved comparison function to generate more accurate correction results
-        corrections = compare_sentences(original, corrected)
+        # the edits come with the tags that caused them, only the offsets have to be computed
+        corrections = build_corrections(original, spans, edits)
+        corrected = apply_corrections(original, corrections)
         
         processing_time = time.time() - start_time
+        observe_request("/correct", processing_time)
         logger.info(f"Processed in {processing_time:.2f}s with {len(corrections)} corrections")
         
         return {
@@ -134,10 +483,264 @@ async def correct(input: SentenceInput):
             "original": original,
             "processing_time": f"{processing_time:.2f}s"
         }
+    except QueueFullError:
+        logger.warning(f"Rejected request, {batcher.pending} requests are pending")
+        count_error("/correct", "overloaded")
+        return overloaded_response(corrections=[], corrected=input.text)
     except Exception as e:
         logger.error(f"Error processing request: {str(e)}")
+        count_error("/correct", "exception")
         return {"error": str(e), "corrections": [], "corrected": input.text}
 
+def build_sentence_result(text: str, start: int, end: int, result: Tuple[str, List[Dict[str, Any]]]) -> Dict[str, Any]:
+    """
+    build the corrections of one sentence of the text with offsets in the whole text
+    """
+    _, spans = model_input(text, start, end)
+    _, edits = result
+    corrections = build_corrections(text, spans, edits)
+    return {
+        "original": text[start:end],
+        "corrected": apply_corrections(text, corrections, start, end),
+        "startIndex": start,
+        "endIndex": end,
+        "corrections": corrections
+    }
+
+def join_corrected_text(text: str, sentences: List[Dict[str, Any]]) -> str:
+    parts = []
+    last_end = 0
+    for sent in sentences:
+        # the corrected sentences keep their original spacing, and so does the text between them
+        parts.append(text[last_end:sent["startIndex"]])
+        parts.append(sent["corrected"])
+        last_end = sent["endIndex"]
+    parts.append(text[last_end:])
+    return ''.join(parts)
+
+def sentence_fingerprint(sentence: str) -> str:
+    # the exact text is hashed, so that reused offsets are still valid inside the sentence
+    return hashlib.sha1(sentence.encode('utf-8')).hexdigest()
+
+def shift_corrections(corrections: List[Dict[str, Any]], shift: int) -> List[Dict[str, Any]]:
+    return [
+        {**c, "startIndex": c["startIndex"] + shift, "endIndex": c["endIndex"] + shift}
+        for c in corrections
+    ]
+
+def build_document_result(text: str, spans, results: List[Tuple[str, List[Dict[str, Any]]]]) -> Dict[str, Any]:
+    """
+    map the per-sentence corrections back to character offsets in the whole text
+    """
+    sentences = [
+        build_sentence_result(text, start, end, result)
+        for (start, end), result in zip(spans, results)
+    ]
+    corrections = []
+    for sent in sentences:
+        for c in sent["corrections"]:
+            c["id"] = len(corrections) + 1
+            corrections.append(c)
+    return {
+        "original": text,
+        "corrected": join_corrected_text(text, sentences),
+        "corrections": corrections,
+        "sentences": sentences
+    }
+
+@app.post("/correct/batch")
+async def correct_batch(input: BatchInput):
+    start_time = time.time()
+    texts = input.texts + ([input.text] if input.text is not None else [])
+    logger.info(f"Received batch correction request for {len(texts)} texts")
+
+    try:
+        # split every text into sentences and correct all of them in one job
+        text_spans = [split_sentences(text) for text in texts]
+        srcs = [
+            model_input(text, start, end)[0]
+            for text, spans in zip(texts, text_spans)
+            for start, end in spans
+        ]
+        corrected_sents = await correct_sentences(srcs)
+
+        results = []
+        offset = 0
+        for text, spans in zip(texts, text_spans):
+            results.append(build_document_result(text, spans, corrected_sents[offset:offset+len(spans)]))
+            offset += len(spans)
+
+        processing_time = time.time() - start_time
+        observe_request("/correct/batch", processing_time)
+        logger.info(f"Processed {len(srcs)} sentences in {processing_time:.2f}s")
+
+        return {
+            "results": results,
+            "processing_time": f"{processing_time:.2f}s"
+        }
+    except QueueFullError:
+        logger.warning(f"Rejected batch request, {batcher.pending} requests are pending")
+        count_error("/correct/batch", "overloaded")
+        return overloaded_response(results=[])
+    except Exception as e:
+        logger.error(f"Error processing batch request: {str(e)}")
+        count_error("/correct/batch", "exception")
+        return {"error": str(e), "results": []}
+
+@app.post("/correct/stream")
+async def correct_stream(input: SentenceInput):
+    """
+    stream the corrections as NDJSON, one line per sentence in the order they finish,
+    followed by a final line with the whole corrected text
+    """
+    start_time = time.time()
+    text = input.text
+    logger.info(f"Received streaming correction request for text: {text[:50]}...")
+    spans = split_sentences(text)
+    try:
+        futures = await submit_sentences([model_input(text, start, end)[0] for start, end in spans])
+    except QueueFullError:
+        logger.warning(f"Rejected streaming request, {batcher.pending} requests are pending")
+        count_error("/correct/stream", "overloaded")
+        return overloaded_response(corrections=[], corrected=text)
+
+    async def wait_sentence(index: int, future: asyncio.Future):
+        return index, await asyncio.shield(future)
+
+    async def stream():
+        tasks = [asyncio.ensure_future(wait_sentence(i, f)) for i, f in enumerate(futures)]
+        sentences = [None] * len(spans)
+        n_corrections = 0
+        n_done = 0
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                index, result = await next_done
+                start, end = spans[index]
+                sent = build_sentence_result(text, start, end, result)
+                for c in sent["corrections"]:
+                    n_corrections += 1
+                    c["id"] = n_corrections
+                if n_done == 0:
+                    REGISTRY.histogram(
+                        'gector_stream_first_result_seconds', 'Time until the first sentence is streamed'
+                    ).observe(time.time() - start_time)
+                n_done += 1
+                sentences[index] = sent
+                yield json.dumps({"index": index, **sent}) + "\n"
+            processing_time = time.time() - start_time
+            observe_request("/correct/stream", processing_time)
+            logger.info(f"Streamed {len(spans)} sentences in {processing_time:.2f}s with {n_corrections} corrections")
+            yield json.dumps({
+                "done": True,
+                "original": text,
+                "corrected": join_corrected_text(text, sentences),
+                "n_sentences": len(spans),
+                "processing_time": f"{processing_time:.2f}s"
+            }) + "\n"
+        except Exception as e:
+            logger.error(f"Error processing streaming request: {str(e)}")
+            count_error("/correct/stream", "exception")
+            yield json.dumps({"done": True, "error": str(e)}) + "\n"
+        finally:
+            # the client may have disconnected, stop waiting for the remaining sentences
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@app.post("/correct/incremental")
+async def correct_incremental(input: IncrementalInput):
+    """
+    correct only the sentences that are new or changed since the version the client holds,
+    the results of the other sentences are reused with shifted offsets
+    """
+    start_time = time.time()
+    text = input.text
+    previous = await run_in_threadpool(versions.get, input.version) if input.version else None
+    spans = split_sentences(text)
+    fingerprints = [sentence_fingerprint(text[start:end]) for start, end in spans]
+
+    sentences = [None] * len(spans)
+    changed = []
+    for i, ((start, end), fingerprint) in enumerate(zip(spans, fingerprints)):
+        if previous is not None and fingerprint in previous:
+            corrected, corrections = previous[fingerprint]
+            sentences[i] = {
+                "original": text[start:end],
+                "corrected": corrected,
+                "startIndex": start,
+                "endIndex": end,
+                "corrections": shift_corrections(corrections, start)
+            }
+        else:
+            changed.append(i)
+
+    try:
+        corrected_sents = await correct_sentences([
+            model_input(text, spans[i][0], spans[i][1])[0] for i in changed
+        ])
+    except QueueFullError:
+        logger.warning(f"Rejected incremental request, {batcher.pending} requests are pending")
+        count_error("/correct/incremental", "overloaded")
+        return overloaded_response(corrections=[], corrected=text, version=input.version)
+    except Exception as e:
+        logger.error(f"Error processing incremental request: {str(e)}")
+        count_error("/correct/incremental", "exception")
+        return {"error": str(e), "corrections": [], "corrected": text, "version": input.version}
+    for i, result in zip(changed, corrected_sents):
+        start, end = spans[i]
+        sentences[i] = build_sentence_result(text, start, end, result)
+
+    corrections = []
+    for sent in sentences:
+        for c in sent["corrections"]:
+            c["id"] = len(corrections) + 1
+            corrections.append(c)
+    # remember the corrections relative to the sentence start for the next version
+    version = await run_in_threadpool(versions.put, {
+        fingerprint: (sent["corrected"], shift_corrections(sent["corrections"], -sent["startIndex"]))
+        for fingerprint, sent in zip(fingerprints, sentences)
+    })
+
+    processing_time = time.time() - start_time
+    observe_request("/correct/incremental", processing_time)
+    logger.info(
+        f"Processed incremental request in {processing_time:.2f}s, "
+        f"{len(changed)} of {len(spans)} sentences corrected"
+    )
+    return {
+        "version": version,
+        "previous_version_found": previous is not None,
+        "corrections": corrections,
+        "corrected": join_corrected_text(text, sentences),
+        "original": text,
+        "sentences": sentences,
+        "reused_sentences": len(spans) - len(changed),
+        "corrected_sentences": len(changed),
+        "processing_time": f"{processing_time:.2f}s"
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """
+    prometheus metrics of this worker process
+    """
+    REGISTRY.gauge('gector_pending_jobs', 'Number of jobs waiting for an inference worker').set(batcher.pending)
+    REGISTRY.gauge('gector_inflight_sentences', 'Number of sentences being corrected').set(len(_inflight))
+    if isinstance(model, ReplicaPool):
+        # updates gector_replica_utilization
+        model.stats()
+    if cache is not None:
+        for name, value in cache.stats().items():
+            REGISTRY.gauge(f'gector_cache_{name}', f'Correction cache {name.replace("_", " ")}').set(value)
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/cache/stats")
+async def cache_stats():
+    if cache is None:
+        return {"enabled": False}
+    return {"enabled": True, "inflight": len(_inflight), **cache.stats()}
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=7860)
@@ -4,10 +4,105 @@
 you should run this script in the gector38 virtual environment:
 conda activate gector38
 python run_server.py
+
+to serve with several worker processes that share one copy of the model weights:
+python run_server.py --workers 4
 """
 
+import argparse
+import gc
+import os
+import signal
+import socket
+
 import uvicorn
 
+def serve_prefork(host: str, port: int, workers: int, torch_threads: int):
+    """
+    load the model once in this process, then fork the workers.
+    the workers share the weight pages copy-on-write, so each extra worker
+    only costs its own Python heap instead of a full copy of the model.
+    """
+    import torch
+    # no intra-op thread pool must exist before fork, the workers create their own
+    torch.set_num_threads(1)
+    import main
+    main.load_artifacts()
+    # keep the garbage collector from writing to (and so copying) the pages of the loaded objects
+    gc.collect()
+    gc.freeze()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    children = set()
+    stopping = False
+
+    def spawn():
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            exit_code = 0
+            try:
+                torch.set_num_threads(torch_threads)
+                config = uvicorn.Config(main.app, host=host, port=port)
+                uvicorn.Server(config).run(sockets=[sock])
+            except BaseException:
+                exit_code = 1
+                raise
+            finally:
+                os._exit(exit_code)
+        children.add(pid)
+        print(f"Started worker {pid}")
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for _ in range(workers):
+        spawn()
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        children.discard(pid)
+        if not stopping:
+            print(f"Worker {pid} exited with status {status}, restarting it")
+            spawn()
+    sock.close()
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 7860)))
+    parser.add_argument(
+        '--workers', type=int, default=int(os.environ.get('GECTOR_WORKERS', 0)),
+        help='Number of pre-forked worker processes. 0 runs a single process with auto-reload.'
+    )
+    parser.add_argument(
+        '--torch_threads', type=int, default=int(os.environ.get('GECTOR_TORCH_THREADS', 0)),
+        help='Intra-op threads of each worker. 0 divides the CPU cores between the workers.'
+    )
+    args = parser.parse_args()
+    if args.workers > 1 and int(os.environ.get('GECTOR_REPLICAS', 0)) > 1:
+        # every worker would copy the weights to shared memory and pin its replicas to all the cores
+        parser.error('GECTOR_REPLICAS > 1 can not be used with more than one worker, use either one or the other')
+    return args
+
 if __name__ == "__main__":
-    print("Starting Grammar Correction API server at http://localhost:7860")
-    uvicorn.run("main:app", host="0.0.0.0", port=7860, reload=True)
+    args = get_parser()
+    print(f"Starting Grammar Correction API server at http://localhost:{args.port}")
+    if args.workers > 0:
+        torch_threads = args.torch_threads or max(1, (os.cpu_count() or 1) // args.workers)
+        serve_prefork(args.host, args.port, args.workers, torch_threads)
+    else:
+        uvicorn.run("main:app", host=args.host, port=args.port, reload=True)
@@ -119,10 +119,11 @@ export const EditorProvider = ({ children }) => {
     </div>)
   }
 
-  const checkForCorrections = async (text) => {
+  const checkForCorrections = async (text, onPartial) => {
     try {
       // 使用本地运行的简易语法API
-      const response = await fetch('http://localhost:7860/correct', {
+      // The API streams one NDJSON line per sentence as soon as it is corrected
+      const response = await fetch('http://localhost:7860/correct/stream', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
@@ -135,9 +136,27 @@ export const EditorProvider = ({ children }) => {
         return mockCorrections; // 出错时回退到模拟数据
       }
       
-      const data = await response.json();
-      console.log('Grammar API response:', data); // 调试用，可以在生产环境中移除
-      return data.corrections || [];
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      const results = [];
+      let buffer = '';
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const lines = buffer.split('\n');
+        buffer = lines.pop();
+        for (const line of lines) {
+          if (!line.trim()) continue;
+          const data = JSON.parse(line);
+          if (data.error) throw new Error(data.error);
+          if (data.done) continue;
+          results.push(...data.corrections);
+          // Show the suggestions of finished sentences right away
+          onPartial?.([...results]);
+        }
+      }
+      return results;
     } catch (error) {
       console.error('Error fetching corrections:', error);
       // 如果API调用失败，返回模拟数据作为备选
@@ -187,7 +206,7 @@ export const EditorProvider = ({ children }) => {
       }
        
       try {
-        const correctionResults = await checkForCorrections(text);
+        const correctionResults = await checkForCorrections(text, setCorrections);
         setCorrections(correctionResults);
         
         if (userInfo?.role === 'paid') {